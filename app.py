@@ -1,7 +1,6 @@
-from fastapi import FastAPI, Request, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, Form, UploadFile, File, Cookie
+from fastapi import FastAPI, Request, Response, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, Form, UploadFile, File, Cookie
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.exception_handlers import http_exception_handler
@@ -9,16 +8,29 @@ from sqlalchemy.orm import Session
 from typing import List, Dict, Optional, Union
 from datetime import datetime, timedelta
 import uvicorn
+import asyncio
 import os
-import shutil
 import json
 import secrets
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from rate_limiter import RateLimiter
+from rate_limiter import rate_limiter_from_env
 from starlette.middleware.sessions import SessionMiddleware
 from google_auth import oauth, create_google_user, extract_domain
 from cleanup import cleanup_sold_products, cleanup_orphaned_images
+from search import ensure_search_index
+from migrations import migrate
+from suggest import suggestion_index
+from page_cache import page_cache
+from uploads import FORM_OVERHEAD, MAX_IMAGE_SIZE, UploadSizeLimit, receive_image_upload
+from static_files import CachedStaticFiles, asset_url, fingerprint_all
+import image_store
+from images import schedule_product_image, start_pool, stop_pool
+from user_cache import user_cache
+from chat_writer import message_writer
+from db_pool import db_pool
+from passwords import password_hasher
+from broker import broker_from_env
+from connections import manager_from_env
 import threading
 import time
 
@@ -27,14 +39,22 @@ from database import SessionLocal, engine
 import models
 import schemas
 
-# Create tables
-models.Base.metadata.create_all(bind=engine)
+# Create or upgrade tables
+migrate(engine)
+ensure_search_index(engine)
 
 # JWT settings
 SECRET_KEY = os.environ.get("SECRET_KEY") or secrets.token_hex(32)  # Generate secure random key if not provided
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Listing page sizes
+PAGE_SIZE = 24
+HOME_PAGE_SIZE = 8
+CHAT_PAGE_SIZE = 50
+MAX_CHAT_PAGE_SIZE = 200
+SYNC_BATCH_SIZE = 200
+
 app = FastAPI(title="CIRCLEBUY")
 
 # Add CORS middleware
@@ -56,6 +76,9 @@ async def add_security_headers(request: Request, call_next):
     response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
     return response
 
+# Refuse oversized uploads before the multipart form is read and spooled
+app.add_middleware(UploadSizeLimit, limits={"/sell": MAX_IMAGE_SIZE + FORM_OVERHEAD})
+
 # Add session middleware for OAuth
 app.add_middleware(
     SessionMiddleware, 
@@ -64,49 +87,20 @@ app.add_middleware(
 
 # Mount static files
 os.makedirs("static/images/products", exist_ok=True)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
 
 # Templates
 templates = Jinja2Templates(directory="templates")
-
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+templates.env.globals["asset_url"] = asset_url
 
 # OAuth2
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
 # Initialize rate limiter
-rate_limiter = RateLimiter(requests_per_minute=60)
+rate_limiter = rate_limiter_from_env(requests_per_minute=60)
 
 # WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        # Store connections with user_id as key
-        self.active_connections: Dict[int, List[WebSocket]] = {}
-        
-    async def connect(self, websocket: WebSocket, user_id: int):
-        await websocket.accept()
-        if user_id not in self.active_connections:
-            self.active_connections[user_id] = []
-        self.active_connections[user_id].append(websocket)
-        print(f"User {user_id} connected. Total connections: {len(self.active_connections)}")
-        
-    def disconnect(self, websocket: WebSocket, user_id: int):
-        if user_id in self.active_connections:
-            self.active_connections[user_id].remove(websocket)
-            if not self.active_connections[user_id]:
-                del self.active_connections[user_id]
-            print(f"User {user_id} disconnected. Remaining connections: {len(self.active_connections)}")
-    
-    async def send_personal_message(self, message: str, user_id: int):
-        if user_id in self.active_connections:
-            print(f"Sending message to user {user_id}")
-            for connection in self.active_connections[user_id]:
-                await connection.send_text(message)
-        else:
-            print(f"User {user_id} not connected, cannot send message")
-
-manager = ConnectionManager()
+manager = manager_from_env(broker_from_env())
 
 # Dependency to get DB session
 def get_db():
@@ -117,12 +111,6 @@ def get_db():
         db.close()
 
 # Authentication functions
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -133,19 +121,14 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user_from_cookie(
-    access_token: Optional[str] = Cookie(None, alias="access_token"),
-    db: Session = Depends(get_db)
-):
-    if not access_token:
-        return None
+async def user_from_token(token: str, db: Session):
+    """The User a token was issued to, or None if it is invalid. Served from user_cache when warm"""
+    user = user_cache.get(token)
+    if user is not None:
+        return user
     
     try:
-        # Remove "Bearer " prefix if present
-        if access_token.startswith("Bearer "):
-            access_token = access_token[7:]
-            
-        payload = jwt.decode(access_token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             return None
@@ -153,8 +136,23 @@ async def get_current_user_from_cookie(
     except JWTError:
         return None
     
-    user = models.get_user_by_email(db, email=token_data.username)
-    return user
+    user = await db_pool.run(models.get_user_by_email, db, email=token_data.username)
+    if user is None:
+        return None
+    return user_cache.set(token, user, payload.get("exp"))
+
+async def get_current_user_from_cookie(
+    access_token: Optional[str] = Cookie(None, alias="access_token"),
+    db: Session = Depends(get_db)
+):
+    if not access_token:
+        return None
+    
+    # Remove "Bearer " prefix if present
+    if access_token.startswith("Bearer "):
+        access_token = access_token[7:]
+    
+    return await user_from_token(access_token, db)
 
 async def get_current_user(
     token: Optional[str] = Depends(oauth2_scheme),
@@ -176,22 +174,74 @@ async def get_current_user(
     
     if not token:
         raise credentials_exception
-        
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = schemas.TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-        
-    user = models.get_user_by_email(db, email=token_data.username)
+    
+    user = await user_from_token(token, db)
     if user is None:
         raise credentials_exception
         
     return user
 
+# Listing helpers
+def fetch_page(fetch, *args, **kwargs):
+    """Run a keyset-paginated model query, turning a bad cursor into a 400"""
+    try:
+        return fetch(*args, **kwargs)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def anonymous_page_key(current_user, format, *key):
+    """Cache key for a page every anonymous visitor sees the same way, else None"""
+    if current_user is not None or format == "json":
+        return None
+    return key
+
+def cached_page(key):
+    """Serve a warm page straight from memory, without touching the database"""
+    body = page_cache.get(key) if key else None
+    if body is None:
+        return None
+    return HTMLResponse(content=body, headers={"X-Cache": "HIT"})
+
+def cache_page(key, response):
+    if key and response.status_code == 200:
+        page_cache.set(key, response.body)
+        response.headers["X-Cache"] = "MISS"
+    return response
+
+def product_to_dict(product):
+    return {
+        "id": product.id,
+        "name": product.name,
+        "description": product.description,
+        "price": product.price,
+        "condition": product.condition,
+        "image_url": product.image_url,
+        "thumb_url": product.thumb_url,
+        "card_url": product.card_url,
+        "full_url": product.full_url,
+        "category_id": product.category_id,
+        "seller_id": product.seller_id,
+        "is_sold": product.is_sold,
+        "created_at": product.created_at.isoformat() if product.created_at else None
+    }
+
+def message_to_dict(message):
+    return {
+        "id": message.id,
+        "sender_id": message.sender_id,
+        "receiver_id": message.receiver_id,
+        "content": message.content,
+        "timestamp": message.created_at.isoformat(),
+        "product_id": message.product_id
+    }
+
+def listing_json(products, next_cursor):
+    """JSON variant of a listing page, for "load more" and API clients"""
+    return JSONResponse({
+        "products": [product_to_dict(product) for product in products],
+        "next_cursor": next_cursor
+    })
+
 # Error handlers
 @app.exception_handler(HTTPException)
 async def custom_http_exception_handler(request: Request, exc: HTTPException):
@@ -237,10 +287,23 @@ async def server_error_exception_handler(request: Request, exc):
 
 # Routes
 @app.get("/", response_class=HTMLResponse)
-async def home(request: Request, db: Session = Depends(get_db), current_user: Optional[models.User] = Depends(get_current_user_from_cookie)):
-    products = models.get_products(db, limit=8)
-    categories = models.get_categories(db)
-    return templates.TemplateResponse("index.html", {"request": request, "products": products, "categories": categories, "current_user": current_user})
+async def home(
+    request: Request,
+    cursor: Optional[str] = None,
+    format: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: Optional[models.User] = Depends(get_current_user_from_cookie)
+):
+    cache_key = anonymous_page_key(current_user, format, "home", cursor)
+    cached = cached_page(cache_key)
+    if cached:
+        return cached
+    
+    products, next_cursor = await db_pool.run(fetch_page, models.get_products, db, cursor=cursor, limit=HOME_PAGE_SIZE)
+    if format == "json":
+        return listing_json(products, next_cursor)
+    categories = await db_pool.run(models.get_categories, db)
+    return cache_page(cache_key, templates.TemplateResponse("index.html", {"request": request, "products": products, "next_cursor": next_cursor, "categories": categories, "current_user": current_user}))
 
 @app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request, next: Optional[str] = None):
@@ -258,12 +321,13 @@ async def register(
     university: str = Form(...),
     db: Session = Depends(get_db)
 ):
-    db_user = models.get_user_by_email(db, email=email)
+    db_user = await db_pool.run(models.get_user_by_email, db, email=email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = get_password_hash(password)
-    user = models.create_user(
+    hashed_password = await password_hasher.hash(password)
+    user = await db_pool.run(
+        models.create_user,
         db=db,
         user=schemas.UserCreate(
             email=email,
@@ -282,8 +346,9 @@ async def login_for_access_token(
     db: Session = Depends(get_db),
     next: Optional[str] = Form(None)
 ):
-    user = models.get_user_by_email(db, email=form_data.username)
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = await db_pool.run(models.get_user_by_email, db, email=form_data.username)
+    valid, new_hash = await password_hasher.verify(form_data.password, user.hashed_password) if user else (False, None)
+    if not valid:
         return templates.TemplateResponse(
             "login.html", 
             {
@@ -293,9 +358,15 @@ async def login_for_access_token(
             }
         )
     
+    # Read before the rehash below commits and expires the user
+    email = user.email
+    if new_hash:
+        # Stored with an outdated bcrypt cost; upgrade while we have the password
+        await db_pool.run(models.update_user_password, db, user, new_hash)
+    
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": email}, expires_delta=access_token_expires
     )
     
     redirect_url = next if next else "/"
@@ -311,7 +382,7 @@ async def logout():
 
 @app.get("/favicon.ico")
 async def favicon():
-    return RedirectResponse(url="/static/circlebuy.png", status_code=301)
+    return RedirectResponse(url=asset_url("circlebuy.png"), status_code=301)
 
 @app.get("/product/{product_id}", response_class=HTMLResponse)
 async def product_detail(
@@ -320,21 +391,33 @@ async def product_detail(
     db: Session = Depends(get_db),
     current_user: Optional[models.User] = Depends(get_current_user_from_cookie)
 ):
-    product = models.get_product(db, product_id=product_id)
+    product = await db_pool.run(models.get_product, db, product_id=product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    seller = models.get_user(db, user_id=product.seller_id)
     return templates.TemplateResponse(
         "product_detail.html", 
-        {"request": request, "product": product, "seller": seller, "current_user": current_user}
+        {"request": request, "product": product, "seller": product.seller, "current_user": current_user}
     )
 
 @app.get("/sell", response_class=HTMLResponse)
 async def sell_page(request: Request, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    categories = models.get_categories(db)
+    categories = await db_pool.run(models.get_categories, db)
     return templates.TemplateResponse("sell.html", {"request": request, "categories": categories, "current_user": current_user})
 
+def create_listing(db: Session, pending, **fields):
+    """
+    Move an upload to its content address and create its product while
+    holding the image's lock, so a concurrent release of an identical image
+    cannot delete the file this product is about to share. Returns the new
+    product's id and image URL, read here since register() expires the product.
+    """
+    with image_store.storing(pending.temp_path, pending.digest, pending.extension, pending.directory) as image_url:
+        product = models.create_product(db, schemas.ProductCreate(image_url=image_url, **fields))
+        product_id = product.id
+        image_store.register(db, [image_url], product_id)
+    return product_id, image_url
+
 @app.post("/sell")
 async def create_product(
     name: str = Form(...),
@@ -351,43 +434,31 @@ async def create_product(
         if not image.content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        # Limit file size to 5MB
-        MAX_SIZE = 5 * 1024 * 1024  # 5MB
-        contents = await image.read()
-        if len(contents) > MAX_SIZE:
-            raise HTTPException(status_code=400, detail="File size too large (max 5MB)")
-        
-        # Reset file pointer
-        await image.seek(0)
-        
-        # Generate secure filename
-        file_extension = os.path.splitext(image.filename)[1].lower()
-        allowed_extensions = [".jpg", ".jpeg", ".png", ".gif", ".webp"]
-        if file_extension not in allowed_extensions:
-            raise HTTPException(status_code=400, detail="Invalid file extension")
-        
-        secure_filename = f"{secrets.token_hex(8)}{file_extension}"
-        file_location = f"static/images/products/{secure_filename}"
-        
-        # Save image
-        with open(file_location, "wb") as file_object:
-            shutil.copyfileobj(image.file, file_object)
+        # Stream to a temp file in the image store, enforcing the 5MB limit as it goes
+        pending = await receive_image_upload(image)
         
         # Create product
-        product = models.create_product(
-            db=db,
-            product=schemas.ProductCreate(
+        try:
+            product_id, image_url = await db_pool.run(
+                create_listing,
+                db,
+                pending,
                 name=name,
                 description=description,
                 price=price,
                 category_id=category_id,
                 condition=condition,
-                image_url=f"/static/images/products/{secure_filename}",
                 seller_id=current_user.id
             )
-        )
+        finally:
+            pending.discard()
+        
+        # Resized copies for listing pages are built in the background
+        schedule_product_image(product_id, image_url)
         
-        return RedirectResponse(url=f"/product/{product.id}", status_code=status.HTTP_303_SEE_OTHER)
+        return RedirectResponse(url=f"/product/{product_id}", status_code=status.HTTP_303_SEE_OTHER)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create product: {str(e)}")
 
@@ -395,15 +466,22 @@ async def create_product(
 async def my_products(
     request: Request,
     sold: Optional[str] = None,
+    cursor: Optional[str] = None,
+    format: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    products = models.get_user_products(db, user_id=current_user.id)
+    products, next_cursor = await db_pool.run(
+        fetch_page, models.get_user_products, db, user_id=current_user.id, cursor=cursor, limit=PAGE_SIZE
+    )
+    if format == "json":
+        return listing_json(products, next_cursor)
     return templates.TemplateResponse(
         "my_products.html",
         {
             "request": request, 
             "products": products, 
+            "next_cursor": next_cursor,
             "current_user": current_user,
             "sold_success": sold == "success"
         }
@@ -415,7 +493,7 @@ async def mark_product_sold(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    product = models.get_product(db, product_id=product_id)
+    product = await db_pool.run(models.get_product, db, product_id=product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
@@ -423,7 +501,7 @@ async def mark_product_sold(
         raise HTTPException(status_code=403, detail="You don't have permission to update this product")
     
     # Mark as sold
-    models.update_product_sold_status(db, product_id=product_id, is_sold=1)
+    await db_pool.run(models.update_product_sold_status, db, product_id=product_id, is_sold=1)
     
     # Schedule immediate cleanup in background (after 1 hour)
     import threading
@@ -434,14 +512,13 @@ async def mark_product_sold(
             db_cleanup = SessionLocal()
             sold_product = db_cleanup.query(models.Product).filter(models.Product.id == product_id).first()
             if sold_product and sold_product.is_sold == 1:
-                # Delete image
-                if sold_product.image_url and sold_product.image_url.startswith("/static/images/products/"):
-                    image_path = os.path.join(".", sold_product.image_url.lstrip("/"))
-                    if os.path.exists(image_path):
-                        os.remove(image_path)
-                # Delete product record
+                image_urls = sold_product.image_urls
+                # Delete product record, then the images if no other product shares them
                 db_cleanup.delete(sold_product)
                 db_cleanup.commit()
+                image_store.release(db_cleanup, image_urls)
+                suggestion_index.product_removed(product_id)
+                page_cache.clear()
                 print(f"Cleaned up sold product: {sold_product.name}")
             db_cleanup.close()
         except Exception as e:
@@ -454,36 +531,94 @@ async def mark_product_sold(
 
 @app.get("/messages", response_class=HTMLResponse)
 async def messages_page(request: Request, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    conversations = models.get_user_conversations(db, user_id=current_user.id)
+    conversations = await db_pool.run(models.get_user_conversations, db, user_id=current_user.id)
     return templates.TemplateResponse("messages.html", {"request": request, "conversations": conversations, "current_user": current_user})
 
 @app.get("/api/messages/{other_user_id}")
-async def get_messages(other_user_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    messages = models.get_chat_messages(db, current_user.id, other_user_id)
-    return [
-        {
-            "id": message.id,
-            "sender_id": message.sender_id,
-            "receiver_id": message.receiver_id,
-            "content": message.content,
-            "timestamp": message.created_at.isoformat(),
-            "product_id": message.product_id
-        }
-        for message in messages
-    ]
+async def get_messages(
+    other_user_id: int,
+    response: Response,
+    before_id: Optional[int] = None,
+    limit: int = CHAT_PAGE_SIZE,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    Most recent page of a chat, oldest first. When older messages exist the
+    X-Next-Before-Id header holds the before_id for the page before this one.
+    """
+    limit = min(max(limit, 1), MAX_CHAT_PAGE_SIZE)
+    # Fetch one extra to know whether there is anything older
+    messages = await db_pool.run(
+        models.get_chat_messages, db, current_user.id, other_user_id, limit=limit + 1, before_id=before_id
+    )
+    if len(messages) > limit:
+        messages = messages[1:]
+        response.headers["X-Next-Before-Id"] = str(messages[0].id)
+    if before_id is None:
+        await read_conversation(current_user.id, other_user_id)
+    return [message_to_dict(message) for message in messages]
+
+async def read_conversation(user_id: int, other_user_id: int):
+    """Mark a chat read and send the other user a read receipt if anything was unread"""
+    if await db_pool.call(models.mark_conversation_read, user_id, other_user_id):
+        await manager.send_personal_message(json.dumps({"type": "read", "user_id": user_id}), other_user_id)
+
+async def resume_chat(outbound, user_id: int, last_seen_message_id: int):
+    """
+    Stream what a reconnecting client missed since last_seen_message_id,
+    then a synced marker. Live messages can arrive in between, so clients
+    skip ids they already have.
+    """
+    await db_pool.call(models.mark_delivered, user_id, last_seen_message_id)
+    last_id = last_seen_message_id
+    while True:
+        missed = await db_pool.call(models.get_messages_since, user_id, last_id, limit=SYNC_BATCH_SIZE)
+        for message in missed:
+            await manager.send(outbound, json.dumps(message_to_dict(message)))
+        if missed:
+            last_id = missed[-1].id
+        if len(missed) < SYNC_BATCH_SIZE:
+            break
+    await manager.send(outbound, json.dumps({"type": "synced", "last_message_id": last_id}))
 
 @app.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: int, db: Session = Depends(get_db)):
-    await manager.connect(websocket, user_id)
+async def websocket_endpoint(
+    websocket: WebSocket,
+    user_id: int,
+    last_seen_message_id: Optional[int] = None,
+    heartbeat: bool = False
+):
+    # ?heartbeat=1 from clients that answer {"type": "ping"} with {"type": "pong"}
+    outbound = await manager.connect(websocket, user_id, heartbeat=heartbeat)
+    if outbound is None:
+        return
     try:
+        if last_seen_message_id is not None:
+            await resume_chat(outbound, user_id, last_seen_message_id)
+        
         while True:
             data = await websocket.receive_text()
             message_data = json.loads(data)
+            kind = message_data.get("type")
             
-            # Save message to database
-            message = models.create_message(
-                db=db,
-                message=schemas.MessageCreate(
+            # Heartbeat replies only prove the client is still there
+            if kind == "pong":
+                outbound.heard(heartbeat=True)
+                continue
+            outbound.heard()
+            
+            # Receipts: the client has everything up to message_id / has read a chat
+            if kind == "ack":
+                await db_pool.call(models.mark_delivered, user_id, int(message_data["message_id"]))
+                continue
+            if kind == "read":
+                await read_conversation(user_id, int(message_data["other_user_id"]))
+                continue
+            
+            # Save message to database, batched with other connections' messages
+            message = await message_writer.submit(
+                schemas.MessageCreate(
                     sender_id=message_data["sender_id"],
                     receiver_id=message_data["receiver_id"],
                     content=message_data["content"],
@@ -492,57 +627,110 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int, db: Session = D
             )
             
             # Format message for sending
-            formatted_message = json.dumps({
-                "id": message.id,
-                "sender_id": message.sender_id,
-                "receiver_id": message.receiver_id,
-                "content": message.content,
-                "timestamp": message.created_at.isoformat(),
-                "product_id": message.product_id
-            })
+            formatted_message = json.dumps(message_to_dict(message))
             
             # Send to both sender and receiver
             await manager.send_personal_message(formatted_message, message.sender_id)
             await manager.send_personal_message(formatted_message, message.receiver_id)
     except WebSocketDisconnect:
-        manager.disconnect(websocket, user_id)
+        pass
     except Exception as e:
         print(f"Error in websocket: {str(e)}")
+    finally:
+        manager.disconnect(websocket, user_id)
 
 @app.get("/search")
 async def search(
     request: Request, 
     q: Optional[str] = None, 
+    cursor: Optional[str] = None,
+    format: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    condition: Optional[str] = None,
+    category_id: Optional[int] = None,
+    sort: str = "relevance",
     db: Session = Depends(get_db),
     current_user: Optional[models.User] = Depends(get_current_user_from_cookie)
 ):
-    if not q:
+    filters = schemas.ProductFilters(
+        min_price=min_price,
+        max_price=max_price,
+        condition=condition or None,
+        category_id=category_id,
+        sort=sort
+    )
+    has_filters = any(value is not None for value in (min_price, max_price, filters.condition, category_id))
+    if not q and not has_filters:
         # If no query provided, show all products or redirect to home
         return RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
     
-    products = models.search_products(db, query=q)
-    return templates.TemplateResponse("search_results.html", {"request": request, "products": products, "query": q, "current_user": current_user})
+    if sort != "relevance" and sort not in models.SEARCH_SORTS:
+        raise HTTPException(status_code=400, detail="Invalid sort order")
+    if filters.condition and filters.condition not in [c.value for c in models.ConditionEnum]:
+        raise HTTPException(status_code=400, detail="Invalid condition")
+    
+    products, next_cursor = await db_pool.run(
+        fetch_page, models.search_products, db, query=q, filters=filters, cursor=cursor, limit=PAGE_SIZE
+    )
+    if format == "json":
+        return listing_json(products, next_cursor)
+    facets = await db_pool.run(models.search_facets, db, query=q, filters=filters)
+    return templates.TemplateResponse(
+        "search_results.html",
+        {
+            "request": request,
+            "products": products,
+            "query": q or "",
+            "filters": filters,
+            "next_cursor": next_cursor,
+            "facets": facets,
+            "current_user": current_user
+        }
+    )
+
+@app.get("/api/search/suggest")
+async def search_suggest(q: Optional[str] = None, limit: int = 8):
+    """Typeahead completions for the search box, served from memory"""
+    await suggestion_index.refresh(db_pool)
+    return {
+        "query": q or "",
+        "suggestions": await db_pool.run(suggestion_index.suggest, q or "", limit=min(max(limit, 1), 20))
+    }
 
 @app.get("/category/{category_id}")
 async def category_products(
     request: Request, 
     category_id: int, 
+    cursor: Optional[str] = None,
+    format: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: Optional[models.User] = Depends(get_current_user_from_cookie)
 ):
-    category = models.get_category(db, category_id=category_id)
+    cache_key = anonymous_page_key(current_user, format, "category", category_id, cursor)
+    cached = cached_page(cache_key)
+    if cached:
+        return cached
+    
+    category = await db_pool.run(models.get_category, db, category_id=category_id)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
     
-    products = models.get_products_by_category(db, category_id=category_id)
-    return templates.TemplateResponse(
-        "category.html", 
-        {"request": request, "category": category, "products": products, "current_user": current_user}
+    products, next_cursor = await db_pool.run(
+        fetch_page, models.get_products_by_category, db, category_id=category_id, cursor=cursor, limit=PAGE_SIZE
     )
+    if format == "json":
+        return listing_json(products, next_cursor)
+    return cache_page(cache_key, templates.TemplateResponse(
+        "category.html", 
+        {"request": request, "category": category, "products": products, "next_cursor": next_cursor, "current_user": current_user}
+    ))
 
 @app.get("/community")
 async def community_page(
     request: Request,
+    cursor: Optional[str] = None,
+    format: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
@@ -553,14 +741,18 @@ async def community_page(
             detail="You need to be logged in with a valid email domain to access your community"
         )
     
+    # Get products from users of the same domain
+    products, next_cursor = await db_pool.run(
+        fetch_page, models.get_products_by_domain, db, domain=current_user.domain, cursor=cursor, limit=PAGE_SIZE
+    )
+    if format == "json":
+        return listing_json(products, next_cursor)
+    
     # Get domain name (university name)
     domain_name = current_user.university or current_user.domain.split('.')[0].capitalize()
     
     # Get users from the same domain
-    users = models.get_users_by_domain(db, domain=current_user.domain)
-    
-    # Get products from users of the same domain
-    products = models.get_products_by_domain(db, domain=current_user.domain)
+    users = await db_pool.run(models.get_users_by_domain, db, domain=current_user.domain)
     
     return templates.TemplateResponse(
         "community.html",
@@ -569,22 +761,45 @@ async def community_page(
             "current_user": current_user,
             "domain_name": domain_name,
             "users": users,
-            "products": products
+            "products": products,
+            "next_cursor": next_cursor
         }
     )
 
+@app.on_event("startup")
+async def start_broker():
+    await manager.broker.start(manager.deliver_local)
+
+@app.on_event("startup")
+async def fingerprint_static_assets():
+    # Hash static assets once here so serving them never does it on the loop
+    await asyncio.to_thread(fingerprint_all)
+
+@app.on_event("startup")
+async def start_image_workers():
+    await asyncio.to_thread(start_pool)
+
+@app.on_event("shutdown")
+async def flush_pending_messages():
+    await message_writer.close()
+    await manager.broker.stop()
+    await manager.stop()
+    await asyncio.to_thread(stop_pool)
+
 def cleanup_task():
     """Background task to clean up old sold products"""
+    runs = 0
     while True:
         try:
             # Run cleanup every 6 hours for better storage management
             time.sleep(21600)  # 6 hours in seconds
+            runs += 1
             count = cleanup_sold_products(days_to_keep=7)  # Keep sold items for only 7 days
             print(f"Cleaned up {count} old sold products")
             
-            # Also cleanup orphaned images
+            # Also cleanup orphaned images, checking the images table against the disk once a day
             from cleanup import cleanup_orphaned_images
-            orphaned = cleanup_orphaned_images()
+            orphaned = cleanup_orphaned_images(reconcile=runs % 4 == 0)
             if orphaned > 0:
                 print(f"Removed {orphaned} orphaned images")
         except Exception as e:
@@ -594,7 +809,7 @@ def cleanup_task():
 async def storage_stats(request: Request, db: Session = Depends(get_db)):
     """Storage management page - shows storage stats and cleanup options"""
     from cleanup import get_storage_stats
-    stats = get_storage_stats()
+    stats = await db_pool.run(get_storage_stats)
     
     return templates.TemplateResponse("storage_admin.html", {
         "request": request,
@@ -606,15 +821,25 @@ async def manual_cleanup(db: Session = Depends(get_db)):
     """Manual cleanup trigger"""
     try:
         # Cleanup sold products
-        cleaned = cleanup_sold_products(days_to_keep=7)
+        cleaned = await db_pool.run(cleanup_sold_products, days_to_keep=7)
         
         # Cleanup orphaned images
-        orphaned = cleanup_orphaned_images()
+        orphaned = await db_pool.run(cleanup_orphaned_images)
         
         return {"success": True, "cleaned_products": cleaned, "orphaned_images": orphaned}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+@app.get("/admin/connections")
+async def connection_stats():
+    """WebSocket connections on this worker, outbound queue depth and drops"""
+    return manager.metrics()
+
+@app.get("/admin/passwords")
+async def password_stats():
+    """bcrypt pool on this worker: queued and completed hashes, rehashes"""
+    return password_hasher.metrics()
+
 if __name__ == "__main__":
     # Start cleanup task in background
     cleanup_thread = threading.Thread(target=cleanup_task, daemon=True)
@@ -0,0 +1,121 @@
+"""
+Concurrent-request benchmark for the DB thread pool.
+
+Seeds a throwaway database, then fires concurrent JSON listing and search
+requests at the app in-process while a ticker measures how long the event
+loop goes unanswered (what a WebSocket heartbeat on the same worker would
+feel). Each setting runs in its own process because the pool is configured
+from DB_POOL_SIZE at import time.
+
+    python benchmark_db_pool.py [requests] [concurrency]
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+def seed(products: int = 5000):
+    import models
+    import schemas
+    from database import SessionLocal, engine
+    from migrations import migrate
+    from search import ensure_search_index
+    migrate(engine)
+    ensure_search_index(engine)
+    db = SessionLocal()
+    try:
+        if db.query(models.Product).count():
+            return
+        seller = models.create_user(db, schemas.UserCreate(
+            email="bench@campus.edu", password="x", full_name="Bench", university="Campus"
+        ))
+        for name in ("Books", "Electronics", "Furniture", "Clothing"):
+            db.add(models.Category(name=name, description=name))
+        db.commit()
+        words = ["calculator", "textbook", "lamp", "desk", "chair", "bike", "jacket", "laptop", "monitor", "kettle"]
+        db.bulk_save_objects([
+            models.Product(
+                name=f"{words[i % len(words)]} {words[(i * 7) % len(words)]} {i}",
+                description=f"Used {words[(i * 3) % len(words)]} in good condition",
+                price=float(i % 900 + 5),
+                condition="Good",
+                image_url="/static/images/products/none.jpg",
+                category_id=i % 4 + 1,
+                seller_id=seller.id
+            )
+            for i in range(products)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+async def measure(total: int, concurrency: int):
+    import httpx
+    import app as app_module
+
+    paths = ["/category/2?format=json", "/search?q=lamp&format=json", "/?format=json", "/search?q=desk&sort=price_asc&format=json"]
+    latencies = []
+    max_lag = 0.0
+
+    async def ticker():
+        nonlocal max_lag
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(0.005)
+            max_lag = max(max_lag, time.perf_counter() - started - 0.005)
+
+    async with httpx.AsyncClient(app=app_module.app, base_url="http://bench") as client:
+        queue = asyncio.Queue()
+        for n in range(total):
+            queue.put_nowait(paths[n % len(paths)])
+
+        async def worker():
+            while not queue.empty():
+                path = queue.get_nowait()
+                started = time.perf_counter()
+                response = await client.get(path)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+
+        tick = asyncio.ensure_future(ticker())
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        tick.cancel()
+
+    latencies.sort()
+    return {
+        "throughput": total / elapsed,
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p99": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "max_loop_lag": max_lag * 1000,
+    }
+
+def run_setting(pool_size: str, database_url: str, total: int, concurrency: int):
+    env = dict(os.environ, DATABASE_URL=database_url, DB_POOL_SIZE=pool_size)
+    output = subprocess.run(
+        [sys.executable, __file__, "--measure", str(total), str(concurrency)],
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--measure"]:
+        result = asyncio.run(measure(int(sys.argv[2]), int(sys.argv[3])))
+        print(json.dumps(result))
+        sys.exit(0)
+
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ["DATABASE_URL"] = database_url
+        seed()
+        print(f"{total} requests, {concurrency} concurrent")
+        print(f"{'setting':<16}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max loop lag ms':>18}")
+        for label, pool_size in (("inline (before)", "0"), ("pool of 8", "8")):
+            result = run_setting(pool_size, database_url, total, concurrency)
+            print(f"{label:<16}{result['throughput']:>10.0f}{result['p50']:>10.1f}{result['p99']:>10.1f}{result['max_loop_lag']:>18.1f}")
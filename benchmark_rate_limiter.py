@@ -0,0 +1,68 @@
+"""
+Microbenchmark: the GCRA RateLimiter against the sliding-window list
+implementation it replaced, for 100k distinct client IPs.
+
+    python benchmark_rate_limiter.py [ips] [requests_per_ip]
+"""
+import random
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+from fastapi import HTTPException
+from rate_limiter import RateLimiter
+
+class SlidingWindowLimiter:
+    """The previous implementation: a list of timestamps per IP, kept forever"""
+
+    def __init__(self, requests_per_minute: int = 60):
+        self.requests_per_minute = requests_per_minute
+        self.requests: Dict[str, List[float]] = {}
+
+    def check_rate_limit(self, ip: str) -> bool:
+        now = time.time()
+        minute_ago = now - 60
+        if ip not in self.requests:
+            self.requests[ip] = []
+        self.requests[ip] = [req_time for req_time in self.requests[ip] if req_time > minute_ago]
+        if len(self.requests[ip]) >= self.requests_per_minute:
+            raise HTTPException(status_code=429, detail="Too many requests. Please try again later.")
+        self.requests[ip].append(now)
+        return True
+
+def check_all(limiter, traffic):
+    limited = 0
+    for ip in traffic:
+        try:
+            limiter.check_rate_limit(ip)
+        except HTTPException:
+            limited += 1
+    return limited
+
+def run(make_limiter, traffic):
+    """Time one pass, then measure retained memory in a second, traced pass"""
+    started = time.perf_counter()
+    limited = check_all(make_limiter(), traffic)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    limiter = make_limiter()
+    check_all(limiter, traffic)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return elapsed, memory, limited
+
+if __name__ == "__main__":
+    ips = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    per_ip = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    addresses = [f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}" for n in range(ips)]
+    traffic = addresses * per_ip
+    random.Random(0).shuffle(traffic)
+    # One hot client hammering far past its limit
+    traffic += ["203.0.113.7"] * 50_000
+
+    print(f"{len(traffic)} checks from {ips} IPs, limit 60/min")
+    print(f"{'limiter':<16}{'ns/check':>10}{'memory MB':>12}{'429s':>10}")
+    for label, make_limiter in (("sliding window", SlidingWindowLimiter), ("GCRA", RateLimiter)):
+        elapsed, memory, limited = run(lambda: make_limiter(60), traffic)
+        print(f"{label:<16}{elapsed / len(traffic) * 1e9:>10.0f}{memory / 1e6:>12.1f}{limited:>10}")
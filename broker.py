@@ -0,0 +1,104 @@
+import asyncio
+import os
+import secrets
+import time
+from sqlalchemy import create_engine, text
+
+class LocalBroker:
+    """
+    Default in-process backend. ConnectionManager already delivers to this
+    worker's sockets, so there is nobody else to tell.
+    """
+
+    async def start(self, deliver):
+        pass
+
+    async def publish(self, user_id: int, message: str):
+        pass
+
+    async def stop(self):
+        pass
+
+class SQLiteBroker:
+    """
+    Cross-worker fan-out through a shared SQLite file, for several gunicorn
+    workers on one host. publish() appends an event; every worker polls for
+    events newer than the last one it saw and delivers those addressed to
+    users connected to it. Events published by a worker are skipped by that
+    same worker, which has already delivered them locally.
+    """
+
+    def __init__(self, url: str, poll_interval: float = 0.05, retention: float = 60.0):
+        self.engine = create_engine(url, connect_args={"check_same_thread": False, "timeout": 5})
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.origin = secrets.token_hex(8)
+        self.last_id = 0
+        self._task = None
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS ws_events ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, origin VARCHAR NOT NULL, "
+                "user_id INTEGER NOT NULL, payload TEXT NOT NULL, created_at FLOAT NOT NULL)"
+            ))
+
+    async def start(self, deliver):
+        loop = asyncio.get_running_loop()
+        self.last_id = await loop.run_in_executor(None, self._max_id)
+        self._task = loop.create_task(self._poll(deliver))
+
+    async def publish(self, user_id: int, message: str):
+        await asyncio.get_running_loop().run_in_executor(None, self._insert, user_id, message)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def _max_id(self) -> int:
+        with self.engine.connect() as conn:
+            return conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM ws_events")).scalar()
+
+    def _insert(self, user_id: int, message: str):
+        with self.engine.begin() as conn:
+            conn.execute(
+                text("INSERT INTO ws_events (origin, user_id, payload, created_at) VALUES (:origin, :user_id, :payload, :now)"),
+                {"origin": self.origin, "user_id": user_id, "payload": message, "now": time.time()}
+            )
+
+    def _fetch(self):
+        with self.engine.connect() as conn:
+            return conn.execute(
+                text("SELECT id, origin, user_id, payload FROM ws_events WHERE id > :last_id ORDER BY id"),
+                {"last_id": self.last_id}
+            ).fetchall()
+
+    def _prune(self):
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM ws_events WHERE created_at < :cutoff"), {"cutoff": time.time() - self.retention})
+
+    async def _poll(self, deliver):
+        loop = asyncio.get_running_loop()
+        last_prune = time.monotonic()
+        while True:
+            try:
+                for event_id, origin, user_id, payload in await loop.run_in_executor(None, self._fetch):
+                    self.last_id = event_id
+                    if origin != self.origin:
+                        await deliver(payload, user_id)
+                if time.monotonic() - last_prune > self.retention:
+                    await loop.run_in_executor(None, self._prune)
+                    last_prune = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error polling WebSocket broker: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+
+def broker_from_env():
+    """WS_BROKER_URL=sqlite:///path shares fan-out between workers; unset stays in-process"""
+    url = os.environ.get("WS_BROKER_URL")
+    if url:
+        return SQLiteBroker(url)
+    return LocalBroker()
@@ -0,0 +1,100 @@
+import asyncio
+from typing import List
+from database import SessionLocal
+import models
+
+class MessageWriter:
+    """
+    Write-behind queue for chat messages arriving over WebSockets.
+
+    Messages submitted while a commit is in flight (or within max_delay of
+    the first one) are inserted together in one transaction, so a burst of
+    chat costs one SQLite commit instead of one per frame. The commit runs
+    in a worker thread; submit() resolves once the batch is durable, which is
+    when the caller should fan the message out.
+    """
+
+    def __init__(self, session_factory=SessionLocal, max_batch: int = 100, max_delay: float = 0.005):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.messages = 0
+        self._loop = None
+        self._queue = None
+        self._task = None
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+
+    async def submit(self, message):
+        """Queue a schemas.MessageCreate and wait for the saved models.Message"""
+        self._ensure_running()
+        future = self._loop.create_future()
+        await self._queue.put((message, future))
+        return await future
+
+    async def close(self):
+        """Flush anything still queued and stop the writer task"""
+        if self._task is None or self._task.done():
+            return
+        await self._queue.put(None)
+        await self._task
+
+    async def _next_batch(self):
+        """Wait for one message, then take whatever else arrives within max_delay"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_delay
+        while batch[-1] is not None and len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            batch.append(item)
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            stopping = batch[-1] is None
+            batch = [item for item in batch if item is not None]
+            if batch:
+                try:
+                    saved = await loop.run_in_executor(None, self._flush, [message for message, _ in batch])
+                except Exception as e:
+                    print(f"Error saving chat messages: {str(e)}")
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for (_, future), message in zip(batch, saved):
+                        if not future.done():
+                            future.set_result(message)
+            if stopping:
+                return
+
+    def _flush(self, messages) -> List[models.Message]:
+        db = self.session_factory()
+        try:
+            saved = models.create_messages(db, messages)
+            # Detach fully loaded rows so they are safe to read on the event loop
+            db.expunge_all()
+            self.batches += 1
+            self.messages += len(saved)
+            return saved
+        finally:
+            db.close()
+
+message_writer = MessageWriter()
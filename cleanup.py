@@ -1,7 +1,10 @@
-import os
 from datetime import datetime, timedelta
+from sqlalchemy.sql import func
 from database import SessionLocal
 import models
+import image_store
+from suggest import suggestion_index
+from page_cache import page_cache
 
 def cleanup_sold_products(days_to_keep=7):
     """
@@ -22,16 +25,11 @@ def cleanup_sold_products(days_to_keep=7):
         ).all()
         
         cleaned_count = 0
+        released = []
+        removed_ids = []
         for product in old_sold_products:
-            # Delete product image if exists
-            if product.image_url and product.image_url.startswith("/static/images/products/"):
-                image_path = os.path.join(".", product.image_url.lstrip("/"))
-                if os.path.exists(image_path):
-                    try:
-                        os.remove(image_path)
-                        print(f"Deleted image: {image_path}")
-                    except Exception as e:
-                        print(f"Error deleting image {image_path}: {str(e)}")
+            released.append(product.image_urls)
+            removed_ids.append(product.id)
             
             # Delete the product record completely to save database space
             db.delete(product)
@@ -39,6 +37,14 @@ def cleanup_sold_products(days_to_keep=7):
             print(f"Removed sold product: {product.name}")
         
         db.commit()
+        # Only once the rows are really gone, or a failed commit would hide live products
+        for product_id in removed_ids:
+            suggestion_index.product_removed(product_id)
+        # Images are shared between identical uploads, so only delete unreferenced ones
+        for image_urls in released:
+            image_store.release(db, image_urls)
+        if cleaned_count:
+            page_cache.clear()
         return cleaned_count
     
     except Exception as e:
@@ -48,35 +54,29 @@ def cleanup_sold_products(days_to_keep=7):
     finally:
         db.close()
 
-def cleanup_orphaned_images():
-    """Remove orphaned images that don't have corresponding products"""
+def cleanup_orphaned_images(reconcile=False, min_age_hours=1):
+    """
+    Remove orphaned images that don't have corresponding products. Orphans
+    come from the images table; reconcile=True first syncs that table with
+    the disk, which is slower but catches files it never saw. Images younger
+    than min_age_hours are left alone, as their product may not exist yet.
+    """
     db = SessionLocal()
     try:
-        # Get all product image URLs from database
-        products = db.query(models.Product).all()
-        used_images = set()
-        for product in products:
-            if product.image_url and product.image_url.startswith("/static/images/products/"):
-                used_images.add(product.image_url.lstrip("/"))
+        if reconcile:
+            added, dropped = image_store.reconcile(db)
+            print(f"Reconciled images table: {added} files recorded, {dropped} missing rows dropped")
         
-        # Check all images in the directory
-        images_dir = "static/images/products"
-        if os.path.exists(images_dir):
-            removed_count = 0
-            for filename in os.listdir(images_dir):
-                file_path = os.path.join(images_dir, filename)
-                relative_path = f"static/images/products/{filename}"
-                
-                if relative_path not in used_images and os.path.isfile(file_path):
-                    try:
-                        os.remove(file_path)
-                        print(f"Removed orphaned image: {filename}")
-                        removed_count += 1
-                    except Exception as e:
-                        print(f"Error removing {filename}: {str(e)}")
-            
-            return removed_count
-        return 0
+        cutoff = datetime.utcnow() - timedelta(hours=min_age_hours)
+        removed_count = 0
+        for image_url in models.get_orphaned_images(db, cutoff):
+            try:
+                if image_store.remove_orphan(db, image_url):
+                    removed_count += 1
+            except Exception as e:
+                print(f"Error removing {image_url}: {str(e)}")
+        
+        return removed_count
     
     finally:
         db.close()
@@ -94,23 +94,15 @@ def get_storage_stats():
     db = SessionLocal()
     try:
         # Product statistics
-        stats['total_products'] = db.query(models.Product).count()
-        stats['sold_products'] = db.query(models.Product).filter(models.Product.is_sold == 1).count()
-        stats['active_products'] = stats['total_products'] - stats['sold_products']
+        total, sold = db.query(func.count(models.Product.id), func.coalesce(func.sum(models.Product.is_sold), 0)).one()
+        stats['total_products'] = total
+        stats['sold_products'] = sold
+        stats['active_products'] = total - sold
         
-        # Image statistics
-        images_dir = "static/images/products"
-        if os.path.exists(images_dir):
-            total_size = 0
-            image_count = 0
-            for filename in os.listdir(images_dir):
-                file_path = os.path.join(images_dir, filename)
-                if os.path.isfile(file_path):
-                    total_size += os.path.getsize(file_path)
-                    image_count += 1
-            
-            stats['total_images'] = image_count
-            stats['storage_size_mb'] = round(total_size / (1024 * 1024), 2)
+        # Image statistics, from the images table rather than the disk
+        image_count, total_size = models.get_image_totals(db)
+        stats['total_images'] = image_count
+        stats['storage_size_mb'] = round(total_size / (1024 * 1024), 2)
     
     finally:
         db.close()
@@ -138,7 +130,7 @@ if __name__ == "__main__":
     
     # Cleanup orphaned images
     print("\nCleaning up orphaned images...")
-    orphaned = cleanup_orphaned_images()
+    orphaned = cleanup_orphaned_images(reconcile=True)
     print(f"Removed {orphaned} orphaned images")
     
     # Show updated stats
@@ -0,0 +1,114 @@
+import os
+import tempfile
+
+# Point the app's own engine somewhere disposable before anything imports
+# database.py, so importing app.py in tests never migrates circlebuy.db
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/circlebuy-test.db")
+
+import pytest
+from fastapi.templating import Jinja2Templates
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import models
+import schemas
+import search
+from migrations import migrate
+
+@pytest.fixture
+def db_engine(tmp_path):
+    """Throwaway SQLite database so tests never touch circlebuy.db"""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False}
+    )
+    migrate(engine)
+    search.ensure_search_index(engine)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def db(db_engine):
+    session = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+
+CARDS = "{% for p in products %}{{ p.name }}|{{ p.seller.full_name }}|{{ p.category.name }}\n{% endfor %}"
+STUB_TEMPLATES = {
+    "index.html": CARDS,
+    "category.html": CARDS,
+    "search_results.html": CARDS,
+    "my_products.html": CARDS,
+    "community.html": CARDS,
+    "product_detail.html": "{{ product.name }}|{{ seller.full_name }}|{{ product.category.name }}",
+    "error.html": "{{ status_code }} {{ error_message }}",
+}
+
+@pytest.fixture
+def client(db_engine, monkeypatch):
+    """TestClient for app.py with get_db and the DB pool bound to the test database"""
+    from fastapi.testclient import TestClient
+    import app as app_module
+    from page_cache import page_cache
+    from db_pool import db_pool
+    from user_cache import user_cache
+    page_cache.clear()
+    user_cache.clear()
+    TestSession = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+    monkeypatch.setattr(db_pool, "session_factory", TestSession)
+    def override_get_db():
+        session = TestSession()
+        try:
+            yield session
+        finally:
+            session.close()
+    app_module.app.dependency_overrides[app_module.get_db] = override_get_db
+    try:
+        yield TestClient(app_module.app)
+    finally:
+        app_module.app.dependency_overrides.clear()
+
+@pytest.fixture
+def templates(tmp_path, monkeypatch):
+    """Minimal templates that touch the same relationships the real ones do"""
+    import app as app_module
+    for name, source in STUB_TEMPLATES.items():
+        (tmp_path / name).write_text(source)
+    monkeypatch.setattr(app_module, "templates", Jinja2Templates(directory=str(tmp_path)))
+
+def login(client, user):
+    """Give client the auth cookie for user"""
+    import app as app_module
+    token = app_module.create_access_token(data={"sub": user.email})
+    client.cookies.set("access_token", f"Bearer {token}")
+
+@pytest.fixture
+def seller(db):
+    return models.create_user(db, schemas.UserCreate(
+        email="seller@campus.edu",
+        password="hashed",
+        full_name="Test Seller",
+        university="Campus"
+    ))
+
+@pytest.fixture
+def category(db):
+    category = models.Category(name="Textbooks", description="Academic textbooks")
+    db.add(category)
+    db.commit()
+    return category
+
+@pytest.fixture
+def make_product(db, seller, category):
+    """Factory for listed products owned by the test seller"""
+    def make(name, description="", price=100.0, condition="Good", category_id=None):
+        return models.create_product(db, schemas.ProductCreate(
+            name=name,
+            description=description,
+            price=price,
+            category_id=category_id or category.id,
+            condition=condition,
+            image_url="/static/images/products/test.jpg",
+            seller_id=seller.id
+        ))
+    return make
@@ -0,0 +1,253 @@
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional
+from fastapi import WebSocket
+from broker import LocalBroker
+
+# What to do when a client falls so far behind that its queue is full
+DROP_OLDEST = "drop_oldest"
+DISCONNECT = "disconnect"
+OVERFLOW_POLICIES = (DROP_OLDEST, DISCONNECT)
+
+# Close codes: reaped or replaced by a newer tab, and "try again later" for
+# clients that cannot keep up or a worker that is full
+CLOSE_GOING_AWAY = 1001
+CLOSE_TOO_SLOW = 1013
+
+PING = json.dumps({"type": "ping"})
+
+class Outbound:
+    """
+    A socket's pending frames, sent in order by a writer task of its own so
+    a slow client only ever delays itself.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: int, max_queue: int, heartbeat: bool = False):
+        self.websocket = websocket
+        self.user_id = user_id
+        # Only clients that asked for pings are expected to answer them
+        self.heartbeat = heartbeat
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.task = None
+        # last_seen moves on any frame, pongs included; last_active only on chat
+        self.last_seen = self.last_active = time.monotonic()
+
+    def heard(self, heartbeat: bool = False):
+        self.last_seen = time.monotonic()
+        if not heartbeat:
+            self.last_active = self.last_seen
+
+class ConnectionManager:
+    """
+    Sockets connected to this worker. A heartbeat task pings the sockets that
+    opted in to heartbeats each ping_interval and reaps those that have not
+    sent anything within ping_timeout; any socket that sent no chat for
+    idle_timeout seconds (0 disables) is reaped too, so abandoned tabs do
+    not pile up. Clients that predate heartbeats are never pinged. A user's
+    oldest socket is closed when they open more than max_per_user, and new
+    sockets are refused beyond max_connections.
+    """
+
+    def __init__(
+        self,
+        broker=None,
+        max_queue: int = 100,
+        overflow_policy: str = DROP_OLDEST,
+        ping_interval: float = 25.0,
+        ping_timeout: float = 20.0,
+        idle_timeout: float = 3600.0,
+        max_per_user: int = 5,
+        max_connections: int = 1000
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        # Store connections with user_id as key
+        self.active_connections: Dict[int, List[Outbound]] = {}
+        # Relays messages to users connected to other worker processes
+        self.broker = broker or LocalBroker()
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.idle_timeout = idle_timeout
+        self.max_per_user = max_per_user
+        self.max_connections = max_connections
+        self.sent = 0
+        self.dropped = 0
+        self.slow_disconnects = 0
+        self.reaped = 0
+        self.evicted = 0
+        self.rejected = 0
+        self._heartbeat = None
+
+    async def connect(self, websocket: WebSocket, user_id: int, heartbeat: bool = False) -> Optional[Outbound]:
+        """
+        Accept the socket, or refuse it and return None when the worker is
+        full. heartbeat=True for clients that answer pings with pongs.
+        """
+        if self.connection_count() >= self.max_connections:
+            self.rejected += 1
+            print(f"Refusing connection for user {user_id}: {self.connection_count()} connections open")
+            await self._close(websocket, CLOSE_TOO_SLOW)
+            return None
+        await websocket.accept()
+        connections = self.active_connections.setdefault(user_id, [])
+        while len(connections) >= self.max_per_user:
+            oldest = connections[0]
+            self.evicted += 1
+            self._drop(oldest, CLOSE_GOING_AWAY)
+            connections = self.active_connections.setdefault(user_id, [])
+        outbound = Outbound(websocket, user_id, self.max_queue, heartbeat)
+        outbound.task = asyncio.get_running_loop().create_task(self._writer(outbound))
+        connections.append(outbound)
+        self._ensure_heartbeat()
+        print(f"User {user_id} connected. Total connections: {len(self.active_connections)}")
+        return outbound
+
+    def disconnect(self, websocket: WebSocket, user_id: int):
+        outbound = self._find(websocket, user_id)
+        if outbound is None:
+            return
+        self._remove(outbound)
+        print(f"User {user_id} disconnected. Remaining connections: {len(self.active_connections)}")
+
+    async def send_personal_message(self, message: str, user_id: int):
+        await self.deliver_local(message, user_id)
+        await self.broker.publish(user_id, message)
+
+    async def deliver_local(self, message: str, user_id: int):
+        """Queue for the user's sockets on this worker only; never waits on a client"""
+        for outbound in list(self.active_connections.get(user_id, [])):
+            try:
+                outbound.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._overflow(outbound, message)
+
+    async def send(self, outbound: Outbound, message: str):
+        """
+        Queue a frame that must not be dropped, waiting for room instead.
+        Raises asyncio.TimeoutError for a client that stays stuck.
+        """
+        await asyncio.wait_for(outbound.queue.put(message), self.ping_timeout)
+
+    def connection_count(self) -> int:
+        return sum(len(connections) for connections in self.active_connections.values())
+
+    def sweep(self, now: Optional[float] = None):
+        """Reap dead or idle sockets and ping the rest; one heartbeat tick"""
+        now = time.monotonic() if now is None else now
+        for connections in list(self.active_connections.values()):
+            for outbound in list(connections):
+                if outbound.heartbeat and now - outbound.last_seen > self.ping_interval + self.ping_timeout:
+                    print(f"User {outbound.user_id} missed heartbeats, disconnecting")
+                    self.reaped += 1
+                    self._drop(outbound, CLOSE_GOING_AWAY)
+                elif self.idle_timeout and now - outbound.last_active > self.idle_timeout:
+                    print(f"User {outbound.user_id} idle, disconnecting")
+                    self.reaped += 1
+                    self._drop(outbound, CLOSE_GOING_AWAY)
+                elif outbound.heartbeat:
+                    try:
+                        outbound.queue.put_nowait(PING)
+                    except asyncio.QueueFull:
+                        # Plenty already on its way; a backed-up client is the
+                        # overflow policy's problem, not the heartbeat's
+                        pass
+
+    async def stop(self):
+        if self._heartbeat:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+
+    def metrics(self) -> dict:
+        outbounds = [outbound for connections in self.active_connections.values() for outbound in connections]
+        depths = [outbound.queue.qsize() for outbound in outbounds]
+        return {
+            "users": len(self.active_connections),
+            "connections": len(outbounds),
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "slow_disconnects": self.slow_disconnects,
+            "reaped": self.reaped,
+            "evicted": self.evicted,
+            "rejected": self.rejected,
+        }
+
+    def _overflow(self, outbound: Outbound, message: str):
+        if self.overflow_policy == DROP_OLDEST:
+            outbound.queue.get_nowait()
+            outbound.queue.put_nowait(message)
+            outbound.dropped += 1
+            self.dropped += 1
+            return
+        print(f"User {outbound.user_id} is not keeping up, disconnecting")
+        self.slow_disconnects += 1
+        self._drop(outbound, CLOSE_TOO_SLOW)
+
+    def _drop(self, outbound: Outbound, code: int):
+        """Forget a socket and close it in the background"""
+        self._remove(outbound)
+        asyncio.get_running_loop().create_task(self._close(outbound.websocket, code))
+
+    def _ensure_heartbeat(self):
+        loop = asyncio.get_running_loop()
+        if self._heartbeat is None or self._heartbeat.done() or self._heartbeat.get_loop() is not loop:
+            self._heartbeat = loop.create_task(self._beat())
+
+    async def _beat(self):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error in WebSocket heartbeat: {str(e)}")
+
+    def _find(self, websocket: WebSocket, user_id: int):
+        for outbound in self.active_connections.get(user_id, []):
+            if outbound.websocket is websocket:
+                return outbound
+        return None
+
+    def _remove(self, outbound: Outbound):
+        connections = self.active_connections.get(outbound.user_id, [])
+        if outbound in connections:
+            connections.remove(outbound)
+            if not connections:
+                del self.active_connections[outbound.user_id]
+        if outbound.task and outbound.task is not asyncio.current_task():
+            outbound.task.cancel()
+
+    async def _writer(self, outbound: Outbound):
+        while True:
+            message = await outbound.queue.get()
+            try:
+                await outbound.websocket.send_text(message)
+                self.sent += 1
+            except Exception as e:
+                print(f"Error sending to user {outbound.user_id}: {str(e)}")
+                self._remove(outbound)
+                return
+
+    async def _close(self, websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+def manager_from_env(broker=None) -> ConnectionManager:
+    """WS_* environment variables override the queue, heartbeat and cap defaults"""
+    return ConnectionManager(
+        broker,
+        max_queue=int(os.environ.get("WS_QUEUE_SIZE", "100")),
+        overflow_policy=os.environ.get("WS_OVERFLOW_POLICY", DROP_OLDEST),
+        ping_interval=float(os.environ.get("WS_PING_INTERVAL", "25")),
+        ping_timeout=float(os.environ.get("WS_PING_TIMEOUT", "20")),
+        idle_timeout=float(os.environ.get("WS_IDLE_TIMEOUT", "3600")),
+        max_per_user=int(os.environ.get("WS_MAX_PER_USER", "5")),
+        max_connections=int(os.environ.get("WS_MAX_CONNECTIONS", "1000"))
+    )
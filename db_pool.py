@@ -0,0 +1,53 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from database import SessionLocal
+
+class DBPool:
+    """
+    Dedicated, bounded thread pool for the synchronous SQLAlchemy calls made
+    from async handlers, so a slow query parks a pool thread instead of the
+    event loop that every other request and WebSocket on the worker shares.
+
+    run() executes a blocking call as is, e.g. a models function on the
+    request's session; the session is only ever used by one thread at a time.
+    call() opens a fresh session for the call and closes it afterwards, for
+    long-lived handlers (WebSockets) that must not hold one open.
+
+    max_workers=0 runs everything inline on the loop, as before.
+    """
+
+    def __init__(self, session_factory=SessionLocal, max_workers: int = 8):
+        self.session_factory = session_factory
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="db") if max_workers else None
+        self.calls = 0
+        self.pending = 0
+
+    async def run(self, fn, *args, **kwargs):
+        self.calls += 1
+        if self.executor is None:
+            return fn(*args, **kwargs)
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(fn, *args, **kwargs)
+            )
+        finally:
+            self.pending -= 1
+
+    async def call(self, fn, *args, **kwargs):
+        """Run fn(db, *args, **kwargs) in a session of its own"""
+        def in_session():
+            db = self.session_factory()
+            try:
+                return fn(db, *args, **kwargs)
+            finally:
+                db.close()
+        return await self.run(in_session)
+
+    def metrics(self) -> dict:
+        return {"workers": self.max_workers, "calls": self.calls, "pending": self.pending}
+
+db_pool = DBPool(max_workers=int(os.environ.get("DB_POOL_SIZE", "8")))
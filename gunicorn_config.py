@@ -1,4 +1,5 @@
 import multiprocessing
+import os
 
 # Server socket
 bind = "0.0.0.0:8000"
@@ -8,6 +9,10 @@ backlog = 2048
 workers = multiprocessing.cpu_count() * 2 + 1
 worker_class = "uvicorn.workers.UvicornWorker"
 worker_connections = 1000
+
+# Each worker only holds its own WebSocket connections; share chat fan-out
+# between them through a broker file unless one is configured already
+raw_env = ["WS_BROKER_URL=" + os.environ.get("WS_BROKER_URL", "sqlite:///./ws_broker.db")]
 timeout = 30
 keepalive = 2
 
@@ -0,0 +1,266 @@
+import hashlib
+import os
+import sys
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: without flock only threads of one process are serialised
+    fcntl = None
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it dimensions are left empty
+    Image = None
+
+# Content-addressed image store. A file lives at
+#   static/images/products/<h[0:2]>/<h[2:4]>/<h><ext>
+# where h is the SHA-256 of its bytes, so identical uploads share one file
+# and no directory holds more than a few hundred entries. Resized copies
+# sit beside the original as <h>-<size><ext>. An image is referenced by the
+# Product rows whose image_url points at it, and deleted once none do.
+# Every stored file also has a row in the images table (models.StoredImage)
+# holding its size, dimensions and hash.
+#
+# Reusing a stored file and deleting it must not interleave: an upload that
+# dedupes onto a file, then commits its product, would otherwise lose the
+# file to a release() that counted no references in between. Both hold
+# image_lock for the content while they work.
+
+IMAGE_ROOT = "static/images/products"
+URL_PREFIX = "/static/images/products/"
+
+def shard_name(digest: str, extension: str) -> str:
+    """Path of a content-addressed file relative to IMAGE_ROOT"""
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+def path_for_url(url: Optional[str], root: str = IMAGE_ROOT) -> Optional[str]:
+    if not url or not url.startswith(URL_PREFIX):
+        return None
+    return os.path.join(root, *url[len(URL_PREFIX):].split("/"))
+
+def url_for_name(name: str) -> str:
+    return URL_PREFIX + name
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+_thread_locks = defaultdict(threading.Lock)
+
+def content_key(url_or_name: str) -> str:
+    """What image_lock is keyed on: the digest (or legacy flat name) an image and its resized copies share"""
+    stem = os.path.splitext(url_or_name.rsplit("/", 1)[-1])[0]
+    return stem.split("-", 1)[0]
+
+@contextmanager
+def image_lock(key: str, root: str = IMAGE_ROOT):
+    """
+    Exclusive lock on one stored image across threads and gunicorn workers.
+    Keys are spread over 256 lock files in root/.locks.
+    """
+    stripe = hashlib.sha256(key.encode()).hexdigest()[:2]
+    if fcntl is None:
+        with _thread_locks[stripe]:
+            yield
+        return
+    lock_dir = os.path.join(root, ".locks")
+    os.makedirs(lock_dir, exist_ok=True)
+    with open(os.path.join(lock_dir, stripe), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def commit_file(temp_path: str, digest: str, extension: str, root: str = IMAGE_ROOT) -> str:
+    """
+    Move a fully written temp file to its content address and return the
+    stored name. When the content is already stored the temp file is simply
+    dropped, so re-uploads cost no space.
+    """
+    name = shard_name(digest, extension)
+    final_path = os.path.join(root, name)
+    if os.path.exists(final_path):
+        os.remove(temp_path)
+    else:
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(temp_path, final_path)
+    return name
+
+@contextmanager
+def storing(temp_path: str, digest: str, extension: str, root: str = IMAGE_ROOT):
+    """
+    commit_file under the image's lock, yielding the image URL. Commit the
+    product that uses it inside the block so the file cannot be released
+    before that product counts as a reference.
+    """
+    with image_lock(digest, root):
+        yield url_for_name(commit_file(temp_path, digest, extension, root))
+
+def describe(path: str) -> dict:
+    """images-table fields for a file on disk"""
+    width = height = None
+    if Image is not None:
+        try:
+            # Only reads the header, not the pixels
+            with Image.open(path) as image:
+                width, height = image.size
+        except Exception:
+            pass
+    return {"bytes": os.path.getsize(path), "width": width, "height": height, "sha256": file_digest(path)}
+
+def register(db, image_urls: Iterable[str], product_id: Optional[int] = None, root: str = IMAGE_ROOT) -> int:
+    """Record stored files in the images table. Returns how many urls had a file"""
+    import models
+    rows = []
+    for url in image_urls:
+        path = path_for_url(url, root)
+        if path is not None and os.path.isfile(path):
+            rows.append({"path": url, "product_id": product_id, **describe(path)})
+    models.record_images(db, rows)
+    return len(rows)
+
+def reconcile(db, root: str = IMAGE_ROOT):
+    """
+    Bring the images table in line with the disk: record files it is
+    missing, dated by their mtime, and drop rows whose file is gone.
+    Returns (rows added, rows dropped).
+    """
+    import models
+    recorded = {path for path, in db.query(models.StoredImage.path)}
+    on_disk = {url_for_name(name) for name in iter_files(root)}
+    rows = []
+    for url in on_disk - recorded:
+        path = path_for_url(url, root)
+        created_at = datetime.utcfromtimestamp(os.path.getmtime(path))
+        rows.append({"path": url, "product_id": None, "created_at": created_at, **describe(path)})
+    models.record_images(db, rows)
+    missing = list(recorded - on_disk)
+    models.forget_images(db, missing)
+    return len(rows), len(missing)
+
+def owner_of(db, image_url: str) -> Optional[int]:
+    """The oldest product using the image stored at image_url, if any still does"""
+    import models
+    row = db.query(models.Product.id).filter(models.Product.image_url == image_url).order_by(models.Product.id).first()
+    return row[0] if row else None
+
+def release(db, image_urls: List[str], root: str = IMAGE_ROOT) -> int:
+    """
+    Call after deleting a product with its Product.image_urls (original
+    first). Deletes the files and their images rows once no other product
+    uses the original; resized copies are named after it, so they go with
+    it. While others still use it, the rows pass to the oldest of them.
+    Returns how many files were removed.
+    """
+    import models
+    if not image_urls:
+        return 0
+    with image_lock(content_key(image_urls[0]), root):
+        owner = owner_of(db, image_urls[0])
+        if owner is not None:
+            models.set_image_owner(db, list(image_urls), owner)
+            return 0
+        models.forget_images(db, list(image_urls))
+        removed = 0
+        for url in image_urls:
+            path = path_for_url(url, root)
+            if path is None or not os.path.exists(path):
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+                print(f"Deleted image: {path}")
+            except Exception as e:
+                print(f"Error deleting image {path}: {str(e)}")
+        return removed
+
+def remove_orphan(db, image_url: str, root: str = IMAGE_ROOT) -> bool:
+    """
+    Delete a file the images table lists as unreferenced, checking again
+    under its lock in case an upload has just started sharing it.
+    Returns whether the file and its row were dropped.
+    """
+    import models
+    with image_lock(content_key(image_url), root):
+        if models.is_image_referenced(db, image_url):
+            return False
+        path = path_for_url(image_url, root)
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+            print(f"Removed orphaned image: {image_url}")
+        models.forget_images(db, [image_url])
+        return True
+
+def iter_files(root: str = IMAGE_ROOT) -> Iterator[str]:
+    """Every stored file as a path relative to root, skipping uploads still being written and lock files"""
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+        for filename in filenames:
+            if not filename.startswith("."):
+                yield os.path.relpath(os.path.join(directory, filename), root).replace(os.sep, "/")
+
+def migrate_flat_files(db, root: str = IMAGE_ROOT) -> int:
+    """
+    Move images saved under random flat names into the content-addressed
+    layout and repoint their products. Duplicates collapse into one file.
+    Returns the number of products updated.
+    """
+    import models
+    products = db.query(models.Product).filter(models.Product.image_url.like(URL_PREFIX + "%")).all()
+    updated = 0
+    for product in products:
+        flat_name = product.image_url[len(URL_PREFIX):]
+        source = os.path.join(root, flat_name)
+        if "/" in flat_name or not os.path.exists(source):
+            continue
+        old_urls = product.image_urls
+        extension = os.path.splitext(flat_name)[1]
+        digest = file_digest(source)
+        product.image_url = url_for_name(commit_file(source, digest, extension, root))
+        for size in ("thumb", "card", "full"):
+            column = f"{size}_url"
+            old_url = getattr(product, column)
+            old_path = path_for_url(old_url, root)
+            if old_path is None or not os.path.exists(old_path):
+                setattr(product, column, None)
+                continue
+            # Resized copies keep their name relation to the original
+            derivative_extension = os.path.splitext(old_path)[1]
+            name = f"{digest[:2]}/{digest[2:4]}/{digest}-{size}{derivative_extension}"
+            target = os.path.join(root, name)
+            if os.path.exists(target):
+                os.remove(old_path)
+            else:
+                os.replace(old_path, target)
+            setattr(product, column, url_for_name(name))
+        db.commit()
+        models.forget_images(db, old_urls)
+        register(db, product.image_urls, product.id, root)
+        updated += 1
+    return updated
+
+if __name__ == "__main__":
+    if sys.argv[1:] not in (["migrate"], ["reconcile"]):
+        print("Usage: python image_store.py [migrate|reconcile]")
+        sys.exit(1)
+    from database import SessionLocal
+    from page_cache import page_cache
+    db = SessionLocal()
+    try:
+        if sys.argv[1] == "migrate":
+            print(f"Moved images for {migrate_flat_files(db)} products into the content-addressed store")
+            page_cache.clear()
+        else:
+            added, dropped = reconcile(db)
+            print(f"Recorded {added} files missing from the images table, dropped {dropped} rows without a file")
+    finally:
+        db.close()
@@ -0,0 +1,157 @@
+import asyncio
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+# Larger sources are refused rather than decoded: each RGB copy of a 50MP
+# image is 150MB of worker memory
+MAX_SOURCE_PIXELS = 50_000_000
+
+try:
+    from PIL import Image, ImageOps, features
+    Image.MAX_IMAGE_PIXELS = MAX_SOURCE_PIXELS
+except ImportError:  # Pillow is optional; without it listings use the original upload
+    Image = None
+
+# Derivative name -> longest side in pixels
+DERIVATIVE_SIZES = {"thumb": 160, "card": 480, "full": 1600}
+
+# The app process runs db_pool, bcrypt and executor threads by the time the
+# pool starts, and a forked child can inherit one of their locks held
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+_pool = None
+_pending = set()
+
+def pipeline_enabled() -> bool:
+    return Image is not None
+
+def _derivative_format():
+    if features.check("webp"):
+        return "WEBP", ".webp"
+    return "JPEG", ".jpg"
+
+def build_derivatives(source_path: str) -> Dict[str, str]:
+    """
+    Write the resized copies of one image next to it and return their paths
+    keyed by derivative name. Output is re-encoded from pixels only, so EXIF
+    (camera, GPS) and other metadata are dropped. Runs in a worker process.
+    """
+    image_format, extension = _derivative_format()
+    stem = os.path.splitext(source_path)[0]
+    largest = max(DERIVATIVE_SIZES.values())
+    paths = {}
+    with Image.open(source_path) as original:
+        if original.width * original.height > MAX_SOURCE_PIXELS:
+            raise ValueError(f"{original.width}x{original.height} is larger than {MAX_SOURCE_PIXELS} pixels")
+        if original.format == "JPEG":
+            # Let the decoder scale down by up to 8x while staying above the largest size
+            original.draft("RGB", (largest, largest))
+        # Apply the camera's orientation before the EXIF that carries it is dropped
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        image = image.convert("RGBA" if has_alpha and image_format == "WEBP" else "RGB")
+        # One working copy, shrunk in place from the largest size to the smallest
+        for name, size in sorted(DERIVATIVE_SIZES.items(), key=lambda item: -item[1]):
+            image.thumbnail((size, size), Image.LANCZOS)
+            path = f"{stem}-{name}{extension}"
+            # Stored images are content-addressed, so an existing copy is already right
+            if not os.path.exists(path):
+                image.save(path, image_format, quality=80, optimize=True)
+            paths[name] = path
+    return paths
+
+def _new_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=int(os.environ.get("IMAGE_WORKERS", "2")),
+        mp_context=multiprocessing.get_context(_START_METHOD)
+    )
+
+def _url(path: str) -> str:
+    return "/" + os.path.relpath(path).replace(os.sep, "/")
+
+def _source_path(image_url: str) -> Optional[str]:
+    if not image_url or not image_url.startswith("/static/images/products/"):
+        return None
+    # Absolute, as pool workers need not share this process's working directory
+    return os.path.abspath(image_url.lstrip("/"))
+
+def start_pool():
+    """
+    Create the worker pool and start its processes (and the forkserver).
+    Blocks while they start, so the app calls it in a thread from a startup
+    hook rather than on the first upload.
+    """
+    global _pool
+    if _pool is None and pipeline_enabled():
+        _pool = _new_pool()
+        _pool.submit(os.getpid).result()
+
+def stop_pool():
+    """Let queued images finish, then stop the workers"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+def _record_derivatives(db, product_id: int, urls: Dict[str, str]):
+    import image_store
+    import models
+    models.set_product_image_urls(db, product_id, urls)
+    image_store.register(db, urls.values(), product_id)
+
+async def process_product_image(product_id: int, image_url: str):
+    """Build a product's derivatives in the process pool and record their URLs"""
+    from db_pool import db_pool
+    source = _source_path(image_url)
+    if _pool is None or source is None:
+        return  # No pool outside the app (or without Pillow); backfill() catches up
+    try:
+        paths = await asyncio.get_running_loop().run_in_executor(_pool, build_derivatives, source)
+        await db_pool.call(_record_derivatives, product_id, {name: _url(path) for name, path in paths.items()})
+    except Exception as e:
+        print(f"Error building images for product {product_id}: {str(e)}")
+
+def schedule_product_image(product_id: int, image_url: str):
+    """Start process_product_image without making the request wait for it"""
+    task = asyncio.get_running_loop().create_task(process_product_image(product_id, image_url))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+    return task
+
+def backfill(db):
+    """Build derivatives for every product image that has none yet. Returns the number processed"""
+    import models
+    products = db.query(models.Product).filter(
+        models.Product.image_url.isnot(None), models.Product.card_url.is_(None)
+    ).all()
+    jobs = {product.id: _source_path(product.image_url) for product in products}
+    jobs = {product_id: path for product_id, path in jobs.items() if path and os.path.exists(path)}
+    done = 0
+    with _new_pool() as pool:
+        futures = {product_id: pool.submit(build_derivatives, path) for product_id, path in jobs.items()}
+        for product_id, future in futures.items():
+            try:
+                paths = future.result()
+            except Exception as e:
+                print(f"Skipping product {product_id}: {str(e)}")
+                continue
+            _record_derivatives(db, product_id, {name: _url(path) for name, path in paths.items()})
+            done += 1
+    return done
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["backfill"]:
+        print("Usage: python images.py backfill")
+        sys.exit(1)
+    if not pipeline_enabled():
+        print("Pillow is not installed: pip install Pillow")
+        sys.exit(1)
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        print(f"Built images for {backfill(db)} products")
+    finally:
+        db.close()
@@ -1,9 +1,9 @@
 from database import SessionLocal, engine
-import models
+from migrations import migrate
 from models import Category
 
 def init_db():
-    models.Base.metadata.create_all(bind=engine)
+    migrate(engine)
     
     db = SessionLocal()
     
@@ -0,0 +1,230 @@
+import sys
+import threading
+from contextlib import contextmanager
+from sqlalchemy import event, text
+from sqlalchemy.orm import sessionmaker
+from database import engine
+import models
+import schemas
+import search
+
+try:
+    import fcntl
+except ImportError:  # Windows: without flock only threads of one process are serialised
+    fcntl = None
+
+# Schema migrations, applied in order and recorded in schema_migrations.
+#
+# gunicorn workers all run migrate() on startup. pysqlite does not BEGIN
+# before DDL, so a transaction does not keep them apart; migrate() holds an
+# exclusive lock on a file next to the database instead and reads the
+# applied versions only once it has it. Steps must still be idempotent: a
+# fresh database already gets the latest tables and indexes from create_all
+# in step 1, so later steps use IF NOT EXISTS or check first.
+
+def _initial_schema(conn):
+    models.Base.metadata.create_all(bind=conn)
+
+def _create_index(conn, name, table, columns):
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+
+def _add_column(conn, table, column, ddl):
+    columns = [row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))]
+    if column not in columns:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+def _search_filter_indexes(conn):
+    _create_index(conn, "ix_products_sold_category_price", "products", ["is_sold", "category_id", "price"])
+    _create_index(conn, "ix_products_sold_created", "products", ["is_sold", "created_at"])
+
+def _hot_query_indexes(conn):
+    _create_index(conn, "ix_products_category_sold_created", "products", ["category_id", "is_sold", "created_at"])
+    _create_index(conn, "ix_products_seller_created", "products", ["seller_id", "created_at"])
+    _create_index(conn, "ix_messages_sender_receiver_created", "messages", ["sender_id", "receiver_id", "created_at"])
+    _create_index(conn, "ix_messages_receiver_sender_created", "messages", ["receiver_id", "sender_id", "created_at"])
+
+def _conversations(conn):
+    models.Conversation.__table__.create(bind=conn, checkfirst=True)
+    # Backfill from history; the latest message of a pair has the highest id
+    conn.execute(text("""
+        INSERT OR IGNORE INTO conversations (user_id, other_user_id, last_message_id, last_activity, unread_count)
+        SELECT pairs.user_id, pairs.other_user_id, MAX(pairs.id), MAX(pairs.created_at), 0
+        FROM (
+            SELECT sender_id AS user_id, receiver_id AS other_user_id, id, created_at FROM messages
+            UNION ALL
+            SELECT receiver_id, sender_id, id, created_at FROM messages WHERE receiver_id != sender_id
+        ) AS pairs
+        GROUP BY pairs.user_id, pairs.other_user_id
+    """))
+
+def _message_id_indexes(conn):
+    # Chat history pages by message id, which the created_at indexes cannot
+    # serve in order; the rowid only follows created_at within equal timestamps
+    conn.execute(text("DROP INDEX IF EXISTS ix_messages_sender_receiver_created"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_messages_receiver_sender_created"))
+    _create_index(conn, "ix_messages_sender_receiver_id", "messages", ["sender_id", "receiver_id", "id"])
+    _create_index(conn, "ix_messages_receiver_id", "messages", ["receiver_id", "id"])
+
+def _conversation_receipts(conn):
+    _add_column(conn, "conversations", "delivered_message_id", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, "conversations", "read_message_id", "INTEGER NOT NULL DEFAULT 0")
+    # Existing history counts as delivered, and as read unless still unread
+    conn.execute(text("""
+        UPDATE conversations SET
+            delivered_message_id = last_message_id,
+            read_message_id = CASE WHEN unread_count = 0 THEN last_message_id ELSE 0 END
+        WHERE delivered_message_id = 0
+    """))
+
+def _product_image_derivatives(conn):
+    for column in ("thumb_url", "card_url", "full_url"):
+        _add_column(conn, "products", column, "VARCHAR")
+
+def _image_reference_index(conn):
+    # Shared, content-addressed images are counted by image_url before deleting
+    _create_index(conn, "ix_products_image_url", "products", ["image_url"])
+
+def _image_metadata(conn):
+    # Files already on disk are recorded by image_store.reconcile, not here
+    models.StoredImage.__table__.create(bind=conn, checkfirst=True)
+
+def _price_browse_index(conn):
+    # Price-sorted browsing without a category otherwise sorts every unsold product
+    _create_index(conn, "ix_products_sold_price", "products", ["is_sold", "price"])
+
+MIGRATIONS = [
+    (1, "initial schema", _initial_schema),
+    (2, "search filter indexes", _search_filter_indexes),
+    (3, "hot query indexes", _hot_query_indexes),
+    (4, "conversations read model", _conversations),
+    (5, "message history indexes", _message_id_indexes),
+    (6, "conversation receipts", _conversation_receipts),
+    (7, "product image derivatives", _product_image_derivatives),
+    (8, "image reference index", _image_reference_index),
+    (9, "image metadata", _image_metadata),
+    (10, "price browse index", _price_browse_index),
+]
+
+_thread_lock = threading.Lock()
+
+@contextmanager
+def _migration_lock(bind):
+    """Exclusive lock on migrating this database, across threads and worker processes"""
+    database = bind.url.database
+    if fcntl is None or not database or database == ":memory:":
+        with _thread_lock:
+            yield
+        return
+    with open(f"{database}.migrate.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def migrate(bind=engine):
+    """Apply pending migrations. Returns the versions applied by this call"""
+    applied_now = []
+    with _migration_lock(bind), bind.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, name VARCHAR, "
+            "applied_at DATETIME DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+        for version, name, step in MIGRATIONS:
+            if version in applied:
+                continue
+            step(conn)
+            conn.execute(
+                text("INSERT OR IGNORE INTO schema_migrations (version, name) VALUES (:version, :name)"),
+                {"version": version, "name": name}
+            )
+            applied_now.append(version)
+    return applied_now
+
+def schema_version(bind=engine) -> int:
+    with bind.connect() as conn:
+        return conn.execute(text("SELECT MAX(version) FROM schema_migrations")).scalar() or 0
+
+# Hot query shapes, exercised through the real models.py functions so the
+# plans checked are the SQL those functions actually emit.
+HOT_QUERIES = [
+    ("get_user_by_email", lambda db: models.get_user_by_email(db, "someone@campus.edu")),
+    ("get_products", lambda db: models.get_products(db)),
+    ("get_products_by_category", lambda db: models.get_products_by_category(db, 1)),
+    ("get_user_products", lambda db: models.get_user_products(db, 1)),
+    ("get_products_by_domain", lambda db: models.get_products_by_domain(db, "campus.edu")),
+    ("get_users_by_domain", lambda db: models.get_users_by_domain(db, "campus.edu")),
+    ("get_user_conversations", lambda db: models.get_user_conversations(db, 1)),
+    ("get_chat_messages", lambda db: models.get_chat_messages(db, 1, 2)),
+    ("get_chat_messages (older page)", lambda db: models.get_chat_messages(db, 1, 2, before_id=1000)),
+    ("get_messages_since", lambda db: models.get_messages_since(db, 1, 1000)),
+    ("search_products", lambda db: models.search_products(db, "calculator")),
+    ("search_products (filtered)", lambda db: models.search_products(
+        db, "", schemas.ProductFilters(category_id=1, min_price=10, max_price=500, sort="price_asc")
+    )),
+    ("search_products (price range)", lambda db: models.search_products(
+        db, "", schemas.ProductFilters(min_price=10, max_price=500, sort="price_asc")
+    )),
+    ("search_facets", lambda db: models.search_facets(db, "calculator")),
+]
+
+# Browsing pages through these in index order; sorting the matches in a
+# temp B-tree instead reads all of them before the first page
+INDEX_ORDERED = {"search_products (filtered)", "search_products (price range)"}
+
+def _is_table_scan(detail: str) -> bool:
+    # Only real tables count: FTS5 lookups and subquery co-routines are also
+    # reported as SCAN lines
+    if not detail.startswith("SCAN "):
+        return False
+    return detail.split()[1] in models.Base.metadata.tables
+
+def check_query_plans(bind=engine):
+    """
+    Run every hot query and EXPLAIN what it sent to SQLite.
+    Returns a list of (query name, plan line) for each full table scan, and
+    for each sort of an INDEX_ORDERED query that its index does not serve.
+    """
+    statements = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    problems = []
+    db = sessionmaker(bind=bind)()
+    try:
+        for name, run in HOT_QUERIES:
+            statements.clear()
+            event.listen(bind, "before_cursor_execute", capture)
+            try:
+                run(db)
+            finally:
+                event.remove(bind, "before_cursor_execute", capture)
+            for statement, parameters in statements:
+                plan = db.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+                problems.extend(
+                    (name, row[-1]) for row in plan
+                    if _is_table_scan(row[-1])
+                    or (name in INDEX_ORDERED and row[-1] == "USE TEMP B-TREE FOR ORDER BY")
+                )
+    finally:
+        db.close()
+    return problems
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    if command == "migrate":
+        applied = migrate()
+        print(f"Applied migrations: {applied}" if applied else "Database is up to date")
+        print(f"Schema version: {schema_version()}")
+    elif command == "check":
+        search.ensure_search_index()
+        problems = check_query_plans()
+        for name, detail in problems:
+            print(f"{name}: {detail}")
+        if problems:
+            sys.exit(1)
+        print("All hot queries use an index")
+    else:
+        print("Usage: python migrations.py [migrate|check]")
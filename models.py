@@ -1,8 +1,14 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Text, Enum
-from sqlalchemy.orm import relationship
+from sqlalchemy import event, Column, Integer, String, Float, ForeignKey, DateTime, Text, Enum, Index, UniqueConstraint, and_, case, literal, or_, select, union_all
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import relationship, joinedload, contains_eager, aliased
 from sqlalchemy.sql import func
 from database import Base
-from typing import List
+import search
+from suggest import suggestion_index
+from page_cache import page_cache
+from user_cache import user_cache
+from pagination import keyset_page, raw_timestamp
+from typing import List, Optional
 import enum
 
 class User(Base):
@@ -22,6 +28,12 @@ class User(Base):
     sent_messages = relationship("Message", foreign_keys="Message.sender_id", back_populates="sender")
     received_messages = relationship("Message", foreign_keys="Message.receiver_id", back_populates="receiver")
 
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def forget_cached_user(mapper, connection, user):
+    # Signed-in requests must not keep seeing the old row
+    user_cache.invalidate(user.id)
+
 class Category(Base):
     __tablename__ = "categories"
 
@@ -47,6 +59,10 @@ class Product(Base):
     price = Column(Float)
     condition = Column(String)
     image_url = Column(String)
+    # Resized, metadata-free copies of image_url built by images.py; None until ready
+    thumb_url = Column(String, nullable=True)
+    card_url = Column(String, nullable=True)
+    full_url = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     is_sold = Column(Integer, default=0)
     
@@ -56,6 +72,25 @@ class Product(Base):
     category = relationship("Category", back_populates="products")
     seller = relationship("User", back_populates="products")
     messages = relationship("Message", back_populates="product")
+    
+    __table_args__ = (
+        # Filtered browsing: category + price range over unsold products
+        Index("ix_products_sold_category_price", "is_sold", "category_id", "price"),
+        # Price range in any category, in price order
+        Index("ix_products_sold_price", "is_sold", "price"),
+        # Newest-first listings over unsold products
+        Index("ix_products_sold_created", "is_sold", "created_at"),
+        # get_products_by_category: one category, newest first
+        Index("ix_products_category_sold_created", "category_id", "is_sold", "created_at"),
+        # get_user_products / get_products_by_domain: one seller, newest first
+        Index("ix_products_seller_created", "seller_id", "created_at"),
+        Index("ix_products_image_url", "image_url"),
+    )
+    
+    @property
+    def image_urls(self):
+        """The uploaded image and whichever derivatives exist"""
+        return [url for url in (self.image_url, self.thumb_url, self.card_url, self.full_url) if url]
 
 class Message(Base):
     __tablename__ = "messages"
@@ -71,6 +106,65 @@ class Message(Base):
     sender = relationship("User", foreign_keys=[sender_id], back_populates="sent_messages")
     receiver = relationship("User", foreign_keys=[receiver_id], back_populates="received_messages")
     product = relationship("Product", back_populates="messages")
+    
+    __table_args__ = (
+        # Serves both directions of a chat: each side is an id-ordered range
+        # scan, so a page of history costs the same however long the chat is
+        Index("ix_messages_sender_receiver_id", "sender_id", "receiver_id", "id"),
+        # Everything a user has received after a given id
+        Index("ix_messages_receiver_id", "receiver_id", "id"),
+    )
+
+class StoredImage(Base):
+    """
+    One row per file in the image store (see image_store), kept in step with
+    uploads and deletes so storage stats and orphan checks are queries
+    rather than directory walks.
+    """
+    __tablename__ = "images"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # Public URL path, as stored in Product.image_url and the derivative columns
+    path = Column(String, unique=True, nullable=False)
+    bytes = Column(Integer, nullable=False)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    sha256 = Column(String, index=True)
+    # The oldest product using the file; identical uploads share the row and
+    # image_store.release hands it on when that product goes
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class Conversation(Base):
+    """
+    Inbox read model: one row per user per chat partner, kept current by
+    create_message so the messages page never has to scan message history.
+    """
+    __tablename__ = "conversations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    other_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    last_message_id = Column(Integer, ForeignKey("messages.id"))
+    last_activity = Column(DateTime(timezone=True))
+    unread_count = Column(Integer, default=0, nullable=False)
+    # Receipts: every message of the conversation up to these ids has reached
+    # one of the user's sockets / been read by the user
+    delivered_message_id = Column(Integer, default=0, server_default="0", nullable=False)
+    read_message_id = Column(Integer, default=0, server_default="0", nullable=False)
+    
+    other_user = relationship("User", foreign_keys=[other_user_id])
+    last_message = relationship("Message")
+    
+    __table_args__ = (
+        UniqueConstraint("user_id", "other_user_id", name="uq_conversations_user_other"),
+        Index("ix_conversations_user_activity", "user_id", "last_activity"),
+    )
+
+# Loader profile for anything rendered as a product card or detail page:
+# seller and category come back with the product query instead of lazily,
+# once per row, when the template touches them
+PRODUCT_CARD = (joinedload(Product.seller), joinedload(Product.category))
 
 # Database operations
 def get_user(db, user_id: int):
@@ -79,6 +173,10 @@ def get_user(db, user_id: int):
 def get_user_by_email(db, email: str):
     return db.query(User).filter(User.email == email).first()
 
+def update_user_password(db, user, hashed_password: str):
+    user.hashed_password = hashed_password
+    db.commit()
+
 def get_users(db, skip: int = 0, limit: int = 100):
     return db.query(User).offset(skip).limit(limit).all()
 
@@ -100,22 +198,35 @@ def create_user(db, user):
     return db_user
 
 def get_product(db, product_id: int):
-    return db.query(Product).filter(Product.id == product_id).first()
+    return db.query(Product).options(*PRODUCT_CARD).filter(Product.id == product_id).first()
+
+# Listings are paginated newest first with a keyset cursor over (created_at, id)
+NEWEST_FIRST = (raw_timestamp(Product.created_at), Product.id)
 
-def get_products(db, skip: int = 0, limit: int = 100):
-    return db.query(Product).filter(Product.is_sold == 0).offset(skip).limit(limit).all()
+def get_products(db, cursor: Optional[str] = None, limit: int = 24):
+    """Unsold products, newest first. Returns (products, next_cursor)"""
+    query = db.query(Product).options(*PRODUCT_CARD).filter(Product.is_sold == 0)
+    return keyset_page(query, NEWEST_FIRST, cursor, limit)
 
-def get_products_by_category(db, category_id: int):
-    return db.query(Product).filter(Product.category_id == category_id, Product.is_sold == 0).all()
+def get_products_by_category(db, category_id: int, cursor: Optional[str] = None, limit: int = 24):
+    """Unsold products in a category, newest first. Returns (products, next_cursor)"""
+    query = db.query(Product).options(*PRODUCT_CARD).filter(
+        Product.category_id == category_id, Product.is_sold == 0
+    )
+    return keyset_page(query, NEWEST_FIRST, cursor, limit)
 
-def get_user_products(db, user_id: int):
-    return db.query(Product).filter(Product.seller_id == user_id).all()
+def get_user_products(db, user_id: int, cursor: Optional[str] = None, limit: int = 24):
+    """All of a seller's products, newest first. Returns (products, next_cursor)"""
+    query = db.query(Product).options(*PRODUCT_CARD).filter(Product.seller_id == user_id)
+    return keyset_page(query, NEWEST_FIRST, cursor, limit)
 
 def create_product(db, product):
     db_product = Product(**product.dict())
     db.add(db_product)
     db.commit()
     db.refresh(db_product)
+    suggestion_index.product_listed(db_product)
+    page_cache.clear()
     return db_product
 
 def update_product_sold_status(db, product_id: int, is_sold: int):
@@ -124,8 +235,57 @@ def update_product_sold_status(db, product_id: int, is_sold: int):
         product.is_sold = is_sold
         db.commit()
         db.refresh(product)
+        if is_sold:
+            suggestion_index.product_removed(product.id)
+        else:
+            suggestion_index.product_listed(product)
+        page_cache.clear()
     return product
 
+def set_product_image_urls(db, product_id: int, urls: dict):
+    """Record derivative URLs keyed by size name (thumb, card, full)"""
+    db.query(Product).filter(Product.id == product_id).update(
+        {getattr(Product, f"{name}_url"): url for name, url in urls.items()}, synchronize_session=False
+    )
+    db.commit()
+    page_cache.clear()
+
+def record_images(db, rows: List[dict]):
+    """Add images rows, leaving any path that is already recorded untouched"""
+    if rows:
+        db.execute(sqlite_insert(StoredImage).values(rows).on_conflict_do_nothing(index_elements=["path"]))
+        db.commit()
+
+def forget_images(db, paths: List[str]):
+    if paths:
+        db.query(StoredImage).filter(StoredImage.path.in_(paths)).delete(synchronize_session=False)
+        db.commit()
+
+def set_image_owner(db, paths: List[str], product_id: int):
+    db.query(StoredImage).filter(StoredImage.path.in_(paths)).update(
+        {StoredImage.product_id: product_id}, synchronize_session=False
+    )
+    db.commit()
+
+def _image_columns():
+    return (Product.image_url, Product.thumb_url, Product.card_url, Product.full_url)
+
+def is_image_referenced(db, path: str) -> bool:
+    return db.query(Product.id).filter(or_(*(column == path for column in _image_columns()))).first() is not None
+
+def get_image_totals(db):
+    """(number of stored files, total bytes) in one aggregate query"""
+    count, total = db.query(func.count(StoredImage.id), func.coalesce(func.sum(StoredImage.bytes), 0)).one()
+    return count, total
+
+def get_orphaned_images(db, created_before) -> List[str]:
+    """Paths of recorded images that no product's image columns point at"""
+    referenced = union_all(*(select(column).where(column.isnot(None)) for column in _image_columns()))
+    rows = db.query(StoredImage.path).filter(
+        StoredImage.created_at < created_before, StoredImage.path.notin_(referenced)
+    )
+    return [path for path, in rows]
+
 def get_category(db, category_id: int):
     return db.query(Category).filter(Category.id == category_id).first()
 
@@ -133,51 +293,257 @@ def get_categories(db):
     return db.query(Category).all()
 
 def create_message(db, message):
-    db_message = Message(**message.dict())
-    db.add(db_message)
+    return create_messages(db, [message])[0]
+
+def create_messages(db, messages):
+    """
+    Insert a batch of messages and their inbox updates in one transaction,
+    so the whole batch costs a single commit. Returns the saved messages,
+    reloaded with their server-side defaults in one query.
+    """
+    db_messages = [Message(**message.dict()) for message in messages]
+    db.add_all(db_messages)
+    db.flush()
+    for db_message in db_messages:
+        record_conversation(db, db_message)
+    ids = [db_message.id for db_message in db_messages]
     db.commit()
-    db.refresh(db_message)
-    return db_message
+    
+    saved = {message.id: message for message in db.query(Message).filter(Message.id.in_(ids))}
+    return [saved[message_id] for message_id in ids]
+
+def record_conversation(db, message):
+    """
+    Upsert both participants' inbox rows for a newly flushed message. The
+    receiver gets one more unread message; replying counts as having read
+    the conversation.
+    """
+    sides = [(message.sender_id, message.receiver_id, 0)]
+    if message.receiver_id != message.sender_id:
+        sides.append((message.receiver_id, message.sender_id, 1))
+    sent_at = select(Message.created_at).where(Message.id == message.id).scalar_subquery()
+    for user_id, other_user_id, unread in sides:
+        upsert = sqlite_insert(Conversation).values(
+            user_id=user_id,
+            other_user_id=other_user_id,
+            last_message_id=message.id,
+            last_activity=sent_at,
+            unread_count=unread,
+            delivered_message_id=0 if unread else message.id,
+            read_message_id=0 if unread else message.id
+        )
+        set_ = {
+            "last_message_id": upsert.excluded.last_message_id,
+            "last_activity": upsert.excluded.last_activity,
+            "unread_count": Conversation.unread_count + unread if unread else 0
+        }
+        if not unread:
+            set_["delivered_message_id"] = upsert.excluded.delivered_message_id
+            set_["read_message_id"] = upsert.excluded.read_message_id
+        db.execute(upsert.on_conflict_do_update(index_elements=["user_id", "other_user_id"], set_=set_))
 
 def get_user_conversations(db, user_id: int):
-    sent = db.query(Message).filter(Message.sender_id == user_id).all()
-    received = db.query(Message).filter(Message.receiver_id == user_id).all()
-    
-    # Get unique conversations
-    conversations = {}
-    for message in sent + received:
-        other_user_id = message.receiver_id if message.sender_id == user_id else message.sender_id
-        if other_user_id not in conversations:
-            conversations[other_user_id] = {
-                'user': get_user(db, other_user_id),
-                'last_message': message
-            }
-        elif message.created_at > conversations[other_user_id]['last_message'].created_at:
-            conversations[other_user_id]['last_message'] = message
-    
-    return conversations
-
-def get_chat_messages(db, user1_id: int, user2_id: int, limit: int = 50):
-    """Get chat messages between two users."""
+    """
+    A user's conversations, most recent first, keyed by the other user's id.
+    delivered_message_id and read_message_id are the other user's receipts:
+    how far through the conversation they have received and read.
+    """
+    peer = aliased(Conversation)
+    rows = db.query(Conversation, peer.delivered_message_id, peer.read_message_id).options(
+        joinedload(Conversation.other_user), joinedload(Conversation.last_message)
+    ).outerjoin(peer, (peer.user_id == Conversation.other_user_id) & (peer.other_user_id == Conversation.user_id)).filter(
+        Conversation.user_id == user_id
+    ).order_by(Conversation.last_activity.desc()).all()
+    
+    return {
+        row.other_user_id: {
+            'user': row.other_user,
+            'last_message': row.last_message,
+            'unread_count': row.unread_count,
+            'delivered_message_id': delivered or 0,
+            'read_message_id': read or 0
+        }
+        for row, delivered, read in rows
+    }
+
+def mark_conversation_read(db, user_id: int, other_user_id: int):
+    """Mark everything in the conversation read, which implies delivered. Returns whether anything was unread"""
+    updated = db.query(Conversation).filter(
+        Conversation.user_id == user_id,
+        Conversation.other_user_id == other_user_id,
+        Conversation.read_message_id < Conversation.last_message_id
+    ).update({
+        Conversation.unread_count: 0,
+        Conversation.read_message_id: Conversation.last_message_id,
+        Conversation.delivered_message_id: Conversation.last_message_id
+    }, synchronize_session=False)
+    db.commit()
+    return updated > 0
+
+def mark_delivered(db, user_id: int, up_to_id: int):
+    """Record that every message to user_id up to up_to_id reached the user, in one UPDATE"""
+    watermark = func.min(Conversation.last_message_id, up_to_id)
+    db.query(Conversation).filter(
+        Conversation.user_id == user_id,
+        Conversation.delivered_message_id < watermark
+    ).update({Conversation.delivered_message_id: watermark}, synchronize_session=False)
+    db.commit()
+
+def get_messages_since(db, user_id: int, after_id: int, limit: int = 200):
+    """Messages to user_id newer than after_id, oldest first: what a reconnecting client missed"""
     return db.query(Message).filter(
-        ((Message.sender_id == user1_id) & (Message.receiver_id == user2_id)) |
-        ((Message.sender_id == user2_id) & (Message.receiver_id == user1_id))
-    ).order_by(Message.created_at.asc()).limit(limit).all()
-
-def search_products(db, query: str):
-    return db.query(Product).filter(
-        Product.name.ilike(f"%{query}%") | 
-        Product.description.ilike(f"%{query}%"),
-        Product.is_sold == 0
-    ).all()
+        Message.receiver_id == user_id,
+        Message.id > after_id
+    ).order_by(Message.id).limit(limit).all()
+
+def get_chat_messages(db, user1_id: int, user2_id: int, limit: int = 50, before_id: Optional[int] = None):
+    """
+    Get the most recent chat messages between two users, older than
+    before_id if given. Messages come back oldest first.
+    """
+    def newest_sent(sender_id, receiver_id):
+        # Each direction is its own index range scan that stops after limit rows
+        ids = select(Message.id).where(Message.sender_id == sender_id, Message.receiver_id == receiver_id)
+        if before_id is not None:
+            ids = ids.where(Message.id < before_id)
+        return ids.order_by(Message.id.desc()).limit(limit).subquery().select()
+    
+    newest = union_all(newest_sent(user1_id, user2_id), newest_sent(user2_id, user1_id))
+    messages = db.query(Message).filter(Message.id.in_(newest)).order_by(Message.id.desc()).limit(limit).all()
+    return messages[::-1]
+
+# Upper bounds (exclusive) of the price histogram buckets on search results
+PRICE_BUCKETS = [100, 500, 1000, 5000]
+
+# sort name -> (keyset sort key, descending)
+SEARCH_SORTS = {
+    "price_asc": ((Product.price, Product.id), False),
+    "price_desc": ((Product.price, Product.id), True),
+    "newest": (NEWEST_FIRST, True),
+}
+
+def _search_matches(db, query: str, filters=None):
+    """
+    Query for unsold products matching the search text and filters, or None
+    when the text has nothing searchable. An empty text browses every unsold
+    product. Relevance-ordered queries sort on the returned rank column, which
+    is None when there is no full-text match to rank by.
+    """
+    rank = None
+    if not (query or "").strip():
+        matches = db.query(Product).filter(Product.is_sold == 0)
+    elif not search.fts_enabled:
+        matches = db.query(Product).filter(
+            Product.name.ilike(f"%{query}%") | 
+            Product.description.ilike(f"%{query}%"),
+            Product.is_sold == 0
+        )
+    else:
+        match = search.build_match_query(query)
+        if not match:
+            return None, None
+        ranked = search.ranked_matches().columns(id=Integer, rank=Float).subquery()
+        matches = db.query(Product).join(ranked, ranked.c.id == Product.id).filter(
+            Product.is_sold == 0
+        ).params(match=match)
+        rank = ranked.c.rank
+    
+    if filters:
+        if filters.category_id is not None:
+            matches = matches.filter(Product.category_id == filters.category_id)
+        if filters.min_price is not None:
+            matches = matches.filter(Product.price >= filters.min_price)
+        if filters.max_price is not None:
+            matches = matches.filter(Product.price <= filters.max_price)
+        if filters.condition:
+            matches = matches.filter(Product.condition == filters.condition)
+    return matches, rank
+
+def search_products(db, query: str, filters=None, cursor: Optional[str] = None, limit: int = 24):
+    """
+    Search unsold products, best BM25 match first unless filters ask for
+    another sort. Returns (products, next_cursor).
+    """
+    matches, rank = _search_matches(db, query, filters)
+    if matches is None:
+        return [], None
+    sort = filters.sort if filters else "relevance"
+    if sort in SEARCH_SORTS:
+        keys, descending = SEARCH_SORTS[sort]
+    elif rank is not None:
+        keys, descending = (rank, Product.id), False
+    else:
+        keys, descending = SEARCH_SORTS["newest"]
+    return keyset_page(matches.options(*PRODUCT_CARD), keys, cursor, limit, descending)
+
+def search_facets(db, query: str, filters=None):
+    """
+    Category, condition and price-bucket counts for a search, from a single
+    grouped query over the whole match set. Each facet ignores its own
+    filter, so after picking a category the others are still listed to
+    switch to; the total applies every filter.
+    """
+    facets = {
+        "total": 0,
+        "categories": [],
+        "conditions": [{"value": c.value, "count": 0} for c in ConditionEnum],
+        "prices": [
+            {"min": low, "max": high, "count": 0}
+            for low, high in zip([0] + PRICE_BUCKETS, PRICE_BUCKETS + [None])
+        ]
+    }
+    # Every filter is a facet dimension, so match without them and apply
+    # each one to the grouped rows below
+    matches, _ = _search_matches(db, query)
+    if matches is None:
+        return facets
+    
+    category_id_filter = filters.category_id if filters else None
+    condition_filter = filters.condition if filters else None
+    price_bounds = []
+    if filters and filters.min_price is not None:
+        price_bounds.append(Product.price >= filters.min_price)
+    if filters and filters.max_price is not None:
+        price_bounds.append(Product.price <= filters.max_price)
+    # Buckets alone cannot tell whether a price is inside the filter's bounds
+    in_price = (case((and_(*price_bounds), 1), else_=0) if price_bounds else literal(1)).label("in_price")
+    bucket = case(
+        *[(Product.price < bound, i) for i, bound in enumerate(PRICE_BUCKETS)],
+        else_=len(PRICE_BUCKETS)
+    ).label("bucket")
+    rows = matches.outerjoin(Category, Category.id == Product.category_id).with_entities(
+        Product.category_id, Category.name, Product.condition, bucket, in_price, func.count(Product.id)
+    ).group_by(Product.category_id, Category.name, Product.condition, bucket, in_price).all()
+    
+    categories = {}
+    conditions = {c["value"]: c for c in facets["conditions"]}
+    for category_id, category_name, condition, price_bucket, price_ok, count in rows:
+        category_ok = category_id_filter is None or category_id == category_id_filter
+        condition_ok = not condition_filter or condition == condition_filter
+        if category_ok and condition_ok and price_ok:
+            facets["total"] += count
+        if condition_ok and price_ok:
+            entry = categories.setdefault(category_id, {"id": category_id, "name": category_name, "count": 0})
+            entry["count"] += count
+        if category_ok and price_ok:
+            conditions.setdefault(condition, {"value": condition, "count": 0})["count"] += count
+        if category_ok and condition_ok:
+            facets["prices"][price_bucket]["count"] += count
+    
+    facets["categories"] = sorted(categories.values(), key=lambda c: (-c["count"], c["name"] or ""))
+    facets["conditions"] = list(conditions.values())
+    return facets
 
 def get_users_by_domain(db, domain: str, skip: int = 0, limit: int = 100):
     """Get users from the same domain (community)"""
     return db.query(User).filter(User.domain == domain).offset(skip).limit(limit).all()
 
-def get_products_by_domain(db, domain: str, skip: int = 0, limit: int = 100):
-    """Get products from users of the same domain (community)"""
-    return db.query(Product).join(User).filter(
+def get_products_by_domain(db, domain: str, cursor: Optional[str] = None, limit: int = 24):
+    """Get products from users of the same domain (community). Returns (products, next_cursor)"""
+    query = db.query(Product).join(User).options(
+        contains_eager(Product.seller), joinedload(Product.category)
+    ).filter(
         User.domain == domain,
         Product.is_sold == 0
-    ).offset(skip).limit(limit).all()
\ No newline at end of file
+    )
+    return keyset_page(query, NEWEST_FIRST, cursor, limit)
\ No newline at end of file
@@ -0,0 +1,56 @@
+import base64
+import binascii
+import json
+from sqlalchemy import String, tuple_
+from sqlalchemy.sql.expression import type_coerce
+
+def raw_timestamp(column):
+    """
+    Compare a DateTime column as the text SQLite stores it. Round-tripping
+    through datetime would render '...:00.000000' for CURRENT_TIMESTAMP
+    values stored as '...:00' and break equality between a cursor and its row.
+    """
+    return type_coerce(column, String)
+
+def encode_cursor(values) -> str:
+    """Opaque, URL-safe cursor for the sort key of the last row on a page"""
+    payload = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+def decode_cursor(cursor: str, length: int = None) -> list:
+    """
+    Sort key values from encode_cursor. Raises ValueError for anything that
+    is not a list of length plain scalars, since cursors come from clients.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or (length is not None and len(values) != length):
+        raise ValueError("Invalid cursor")
+    for value in values:
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (str, int, float))):
+            raise ValueError("Invalid cursor")
+    return values
+
+def keyset_page(query, keys, cursor=None, limit: int = 24, descending: bool = True):
+    """
+    Return (items, next_cursor) for one page of query ordered by keys.
+
+    keys must form a unique sort key (end with the primary key) and share one
+    direction. Instead of OFFSET, the page starts strictly after the cursor's
+    key values, so every page is an index range scan however deep it is.
+    """
+    if cursor:
+        values = decode_cursor(cursor, len(keys))
+        if descending:
+            query = query.filter(tuple_(*keys) < tuple_(*values))
+        else:
+            query = query.filter(tuple_(*keys) > tuple_(*values))
+
+    order = [key.desc() if descending else key.asc() for key in keys]
+    rows = query.add_columns(*keys).order_by(*order).limit(limit + 1).all()
+    items = [row[0] for row in rows[:limit]]
+    next_cursor = encode_cursor(rows[limit - 1][1:]) if len(rows) > limit else None
+    return items, next_cursor
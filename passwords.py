@@ -0,0 +1,74 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+class PasswordHasher:
+    """
+    bcrypt on a small thread pool of its own. A hash takes 100-300 ms of CPU,
+    which the bcrypt C code spends without the GIL, so running it here keeps
+    the event loop (and every WebSocket on the worker) responsive through a
+    burst of logins. At most max_workers hashes run at once; beyond
+    max_waiting queued requests new ones are turned away with a 503.
+
+    Hashes made with a different cost than rounds are upgraded on the next
+    successful login (see verify).
+    """
+
+    def __init__(self, rounds: int = 12, max_workers: int = 2, max_waiting: int = 64):
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="bcrypt")
+        self.max_workers = max_workers
+        self.max_waiting = max_waiting
+        self.pending = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_workers + self.max_waiting:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many sign-ins at once. Please try again in a moment."
+            )
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: Optional[str]) -> Tuple[bool, Optional[str]]:
+        """
+        Returns (valid, new_hash). new_hash is set when the password was right
+        but its stored hash uses outdated settings; the caller should save it.
+        """
+        if not hashed_password:
+            return False, None
+        valid, new_hash = await self._run(self.context.verify_and_update, password, hashed_password)
+        if new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def metrics(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "pending": self.pending,
+            "peak_pending": self.peak_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+        }
+
+password_hasher = PasswordHasher(
+    rounds=int(os.environ.get("BCRYPT_ROUNDS", "12")),
+    max_workers=int(os.environ.get("BCRYPT_WORKERS", "2"))
+)
@@ -1,29 +1,103 @@
 from fastapi import HTTPException, status
-from datetime import datetime, timedelta
-from typing import Dict, List
+from sqlalchemy import create_engine, text
+from typing import Dict
+import asyncio
+import os
 import time
 
 class RateLimiter:
-    def __init__(self, requests_per_minute: int = 60):
+    """
+    Generic cell rate algorithm (GCRA): each key holds one float, its
+    theoretical arrival time (TAT). Requests are spaced 60/requests_per_minute
+    seconds apart on average, with a burst of up to requests_per_minute.
+
+    A key whose TAT has passed has no state worth keeping, so keys are swept
+    every sweep_interval seconds and memory only holds recently active IPs.
+    """
+
+    def __init__(self, requests_per_minute: int = 60, sweep_interval: float = 60.0):
+        self.requests_per_minute = requests_per_minute
+        self.emission_interval = 60.0 / requests_per_minute
+        self.burst_tolerance = self.emission_interval * (requests_per_minute - 1)
+        self.sweep_interval = sweep_interval
+        self.requests: Dict[str, float] = {}
+        self._next_sweep = time.time() + sweep_interval
+
+    def check_rate_limit(self, ip: str) -> bool:
+        now = time.time()
+        if now >= self._next_sweep:
+            self.evict_idle(now)
+
+        tat = max(self.requests.get(ip, now), now)
+        if tat - now > self.burst_tolerance:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests. Please try again later."
+            )
+        self.requests[ip] = tat + self.emission_interval
+        return True
+
+    async def check(self, ip: str) -> bool:
+        """check_rate_limit for async handlers; in memory, so it runs inline"""
+        return self.check_rate_limit(ip)
+
+    def evict_idle(self, now: float = None):
+        """Forget keys that have fully recovered; they behave exactly like new ones"""
+        now = time.time() if now is None else now
+        self.requests = {ip: tat for ip, tat in self.requests.items() if tat > now}
+        self._next_sweep = now + self.sweep_interval
+
+class SQLiteRateLimiter:
+    """
+    The same GCRA limit shared by every worker on a host through one SQLite
+    file, so gunicorn's workers enforce one budget per client between them
+    instead of one each. Every check is a single atomic upsert: it only
+    advances the key's TAT while the request is within the burst tolerance,
+    and the row count says whether it did.
+    """
+
+    def __init__(self, url: str, requests_per_minute: int = 60, sweep_interval: float = 60.0):
+        self.engine = create_engine(url, connect_args={"check_same_thread": False, "timeout": 5})
         self.requests_per_minute = requests_per_minute
-        self.requests: Dict[str, List[float]] = {}
-        
+        self.emission_interval = 60.0 / requests_per_minute
+        self.burst_tolerance = self.emission_interval * (requests_per_minute - 1)
+        self.sweep_interval = sweep_interval
+        self._next_sweep = time.time() + sweep_interval
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+            conn.execute(text("CREATE TABLE IF NOT EXISTS rate_limits (key VARCHAR PRIMARY KEY, tat FLOAT NOT NULL)"))
+
     def check_rate_limit(self, ip: str) -> bool:
         now = time.time()
-        minute_ago = now - 60
-        
-        # Initialize or clean old requests
-        if ip not in self.requests:
-            self.requests[ip] = []
-        self.requests[ip] = [req_time for req_time in self.requests[ip] if req_time > minute_ago]
-        
-        # Check if rate limit is exceeded
-        if len(self.requests[ip]) >= self.requests_per_minute:
+        if now >= self._next_sweep:
+            self.evict_idle(now)
+
+        with self.engine.begin() as conn:
+            allowed = conn.execute(text(
+                "INSERT INTO rate_limits (key, tat) VALUES (:key, :now + :interval) "
+                "ON CONFLICT(key) DO UPDATE SET tat = MAX(tat, :now) + :interval "
+                "WHERE MAX(tat, :now) - :now <= :tolerance"
+            ), {"key": ip, "now": now, "interval": self.emission_interval, "tolerance": self.burst_tolerance}).rowcount
+        if not allowed:
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 detail="Too many requests. Please try again later."
             )
-        
-        # Add new request
-        self.requests[ip].append(now)
-        return True
\ No newline at end of file
+        return True
+
+    async def check(self, ip: str) -> bool:
+        """check_rate_limit for async handlers, run in a thread so the upsert does not block the loop"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.check_rate_limit, ip)
+
+    def evict_idle(self, now: float = None):
+        now = time.time() if now is None else now
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM rate_limits WHERE tat <= :now"), {"now": now})
+        self._next_sweep = now + self.sweep_interval
+
+def rate_limiter_from_env(requests_per_minute: int = 60):
+    """RATE_LIMIT_URL=sqlite:///path shares limits between workers; unset keeps them per process"""
+    url = os.environ.get("RATE_LIMIT_URL")
+    if url:
+        return SQLiteRateLimiter(url, requests_per_minute)
+    return RateLimiter(requests_per_minute)
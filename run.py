@@ -2,15 +2,16 @@ import os
 import sys
 import uvicorn
 from database import engine, Base
+from migrations import migrate
 import models
 
 def init_db():
     """Initialize the database with tables only - no demo data"""
     print("Initializing database...")
     
-    # Create tables
+    # Create or upgrade tables
     try:
-        models.Base.metadata.create_all(bind=engine)
+        migrate(engine)
         print("✓ Tables created successfully!")
     except Exception as e:
         print(f"Error creating tables: {str(e)}")
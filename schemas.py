@@ -53,4 +53,11 @@ class Message(MessageCreate):
     created_at: datetime
     
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class ProductFilters(BaseModel):
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    condition: Optional[str] = None
+    category_id: Optional[int] = None
+    sort: str = "relevance"
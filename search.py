@@ -0,0 +1,100 @@
+import re
+import sys
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from database import engine
+
+FTS_TABLE = "products_fts"
+
+# Column weights for bm25(): a hit in the product name counts for more than a
+# hit somewhere in a long description.
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# products_fts is an external-content table: it stores only the index and reads
+# name/description back from products, so the triggers below must mirror every
+# change to those two columns.
+FTS_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description, content='products', content_rowid='id'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, description ON products BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END""",
+]
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Set by ensure_search_index(); models.search_products falls back to LIKE
+# matching when the SQLite build has no FTS5 support.
+fts_enabled = False
+
+def ensure_search_index(bind=engine):
+    """Create the FTS5 table and sync triggers, populating them on first run"""
+    global fts_enabled
+    try:
+        with bind.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": FTS_TABLE}
+            ).first()
+            for statement in FTS_SCHEMA:
+                conn.execute(text(statement))
+            if not exists:
+                conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        fts_enabled = True
+    except OperationalError as e:
+        print(f"Full-text search unavailable, falling back to LIKE search: {str(e)}")
+        fts_enabled = False
+    return fts_enabled
+
+def rebuild_search_index(bind=engine):
+    """Rebuild the full-text index from the products table"""
+    ensure_search_index(bind)
+    if not fts_enabled:
+        return False
+    with bind.begin() as conn:
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+    return True
+
+def build_match_query(query: str) -> str:
+    """
+    Turn free-form user input into a safe FTS5 MATCH expression.
+    Every word must match; the last word is treated as a prefix so results
+    show up while the user is still typing it.
+    """
+    tokens = _TOKEN_RE.findall(query or "")
+    if not tokens:
+        return ""
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+def ranked_matches():
+    """Select of (id, rank) for products matching :match, best match first"""
+    return text(
+        f"SELECT rowid AS id, bm25({FTS_TABLE}, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}) AS rank "
+        f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match"
+    )
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "rebuild":
+        print("Rebuilding product search index...")
+        if rebuild_search_index():
+            print("Search index rebuilt")
+        else:
+            print("FTS5 is not available in this SQLite build")
+    else:
+        print("Usage: python search.py rebuild")
@@ -0,0 +1,161 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+from typing import Dict, Iterator, Optional, Tuple
+from fastapi.staticfiles import StaticFiles
+from starlette.staticfiles import NotModifiedResponse
+from starlette.datastructures import Headers, QueryParams
+from starlette.responses import FileResponse
+from image_store import IMAGE_ROOT
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only gzip variants are built
+    brotli = None
+
+STATIC_DIR = "static"
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# Files named by their SHA-256 (see image_store) never change under the same URL
+CONTENT_ADDRESSED = re.compile(r"^images/products/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(-\w+)?\.\w+$")
+
+# Text assets that get .br/.gz siblings from `python static_files.py compress`
+COMPRESSIBLE = {".css", ".js", ".json", ".svg"}
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+_fingerprints: Dict[str, Tuple[float, int, str]] = {}
+
+def cached_fingerprint(path: str, stat_result: os.stat_result) -> Optional[str]:
+    """fingerprint() of the file as stat_result describes it if already known, without reading it"""
+    # Keyed by real path, as StaticFiles resolves the files it serves
+    cached = _fingerprints.get(os.path.realpath(path))
+    if cached and cached[:2] == (stat_result.st_mtime, stat_result.st_size):
+        return cached[2]
+    return None
+
+def fingerprint(path: str) -> str:
+    """Short content hash of a file, recomputed only when its mtime or size changes"""
+    stat_result = os.stat(path)
+    cached = cached_fingerprint(path, stat_result)
+    if cached:
+        return cached
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(chunk)
+    _fingerprints[os.path.realpath(path)] = (stat_result.st_mtime, stat_result.st_size, digest.hexdigest()[:12])
+    return digest.hexdigest()[:12]
+
+def asset_files(directory: str = STATIC_DIR) -> Iterator[str]:
+    """Paths of the files under directory, leaving out the product image store"""
+    image_root = os.path.join(directory, os.path.relpath(IMAGE_ROOT, STATIC_DIR))
+    for folder, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [name for name in dirnames if os.path.join(folder, name) != image_root]
+        for filename in filenames:
+            yield os.path.join(folder, filename)
+
+def fingerprint_all(directory: str = STATIC_DIR) -> int:
+    """Fingerprint every asset up front (run at startup, off the event loop)"""
+    count = 0
+    for path in asset_files(directory):
+        fingerprint(path)
+        count += 1
+    return count
+
+def asset_url(path: str, directory: str = STATIC_DIR) -> str:
+    """
+    URL for a file under static/ with its fingerprint as ?v=, so templates
+    can let browsers cache it for good and still pick up a changed file.
+    """
+    url = f"/static/{path}"
+    full_path = os.path.join(directory, path)
+    if not os.path.isfile(full_path):
+        return url
+    return f"{url}?v={fingerprint(full_path)}"
+
+def accepted_encodings(header: str) -> set:
+    encodings = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        # "br;q=0" means the client refuses it
+        if name and not re.fullmatch(r"q=0(\.0*)?", params.replace(" ", "")):
+            encodings.add(name.strip().lower())
+    return encodings
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles with caching headers. Content-addressed product images and
+    assets requested with their current ?v= fingerprint are marked immutable;
+    everything else must be revalidated, which the ETag/Last-Modified check
+    answers with a 304. Text assets are served from a pre-built .br or .gz
+    sibling when the client accepts it.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        request_headers = Headers(scope=scope)
+        path = self.get_path(scope).replace(os.sep, "/")
+        full_path = str(full_path)
+
+        if CONTENT_ADDRESSED.match(path):
+            cache_control = IMMUTABLE
+        else:
+            # Never hash here, on the event loop: a file not fingerprinted as
+            # it is now (see fingerprint_all) is only revalidated
+            version = QueryParams(scope.get("query_string", b"")).get("v")
+            current = cached_fingerprint(full_path, stat_result)
+            cache_control = IMMUTABLE if version and version == current else REVALIDATE
+
+        headers = {"Cache-Control": cache_control}
+        media_type = None
+        if os.path.splitext(full_path)[1] in COMPRESSIBLE:
+            headers["Vary"] = "Accept-Encoding"
+            accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+            for encoding, suffix in ENCODINGS:
+                variant = full_path + suffix
+                if encoding in accepted and os.path.isfile(variant):
+                    media_type = mimetypes.guess_type(full_path)[0] or "text/plain"
+                    headers["Content-Encoding"] = encoding
+                    full_path, stat_result = variant, os.stat(variant)
+                    break
+
+        response = FileResponse(
+            full_path, status_code=status_code, headers=headers, media_type=media_type,
+            stat_result=stat_result, method=scope["method"]
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+def _encoders():
+    encoders = {".gz": lambda data: gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        encoders[".br"] = brotli.compress
+    return encoders
+
+def compress(directory: str = STATIC_DIR) -> int:
+    """Write .gz (and .br with brotli installed) copies of text assets that are missing or stale"""
+    written = 0
+    for source in asset_files(directory):
+        if os.path.splitext(source)[1] not in COMPRESSIBLE:
+            continue
+        with open(source, "rb") as f:
+            data = f.read()
+        for suffix, encode in _encoders().items():
+            target = source + suffix
+            if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+                continue
+            with open(target, "wb") as out:
+                out.write(encode(data))
+            written += 1
+    return written
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["compress"]:
+        print("Usage: python static_files.py compress")
+        sys.exit(1)
+    print(f"Wrote {compress()} compressed files")
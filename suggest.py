@@ -0,0 +1,304 @@
+import asyncio
+import re
+import sys
+import time
+import threading
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Set, Tuple
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Rebuild from the database at least this often. Each worker keeps its own
+# index, so this bounds how stale a worker can get for changes made elsewhere.
+REFRESH_SECONDS = 300
+
+# Words examined per prefix scanned and per lookup. A query whose words are
+# shared by more entries than this gets the best of what was examined.
+MAX_SCAN_WORDS = 500
+MAX_LOOKUP_WORDS = 2000
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance, giving up once it exceeds limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = None
+    current = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+    return current[-1]
+
+def _typo_budget(prefix: str) -> int:
+    if len(prefix) >= 8:
+        return 2
+    if len(prefix) >= 4:
+        return 1
+    return 0
+
+# Fuzzy lookup keys are word prefixes up to this long. Longer queries are
+# matched on their first FUZZY_KEY_LENGTH letters and then checked in full.
+FUZZY_KEY_LENGTH = 7
+FUZZY_MIN_LENGTH = 3
+
+def _deletions(text: str, budget: int) -> Set[str]:
+    """text with up to budget letters removed, text itself included"""
+    found = {text}
+    frontier = {text}
+    for _ in range(budget):
+        frontier = {item[:i] + item[i + 1:] for item in frontier for i in range(len(item))}
+        found |= frontier
+    return found
+
+def _key_budget(length: int) -> int:
+    # Keys must cover the budget of a query one letter longer than the prefix
+    return 2 if length >= FUZZY_KEY_LENGTH else 1
+
+class SuggestionIndex:
+    """
+    In-memory typeahead index over product and category names.
+
+    Every word of every name is kept in one sorted list of
+    (word, kind, id) tuples, so a prefix lookup is a bisect plus a short scan
+    that stops once it has enough hits. Typos are found through a deletion
+    neighbourhood built with the index: each distinct word prefix of 3 to 7
+    letters is filed under every string it turns into with one deletion (two
+    at 7 letters). Two strings within that distance share such a key, so a
+    query only checks the prefixes it shares a key with.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._words: List[Tuple[str, str, int]] = []
+        self._labels: Dict[Tuple[str, int], str] = {}
+        self._fuzzy: Dict[str, Set[str]] = {}
+        self._built_at = None
+        self._refresh: Optional[asyncio.Future] = None
+
+    def build(self, db):
+        """Load unsold product names and all category names from the database"""
+        from models import Product, Category
+        entries = [("category", c.id, c.name) for c in db.query(Category.id, Category.name)]
+        entries += [
+            ("product", p.id, p.name)
+            for p in db.query(Product.id, Product.name).filter(Product.is_sold == 0)
+        ]
+        words = []
+        labels = {}
+        for kind, entry_id, label in entries:
+            labels[(kind, entry_id)] = label
+            words.extend((word, kind, entry_id) for word in set(_tokens(label)))
+        words.sort()
+        fuzzy = {}
+        prefixes = {
+            word[:length]
+            for word in {word for word, _, _ in words}
+            for length in range(FUZZY_MIN_LENGTH, min(len(word), FUZZY_KEY_LENGTH) + 1)
+        }
+        for prefix in prefixes:
+            self._file_prefix(fuzzy, prefix)
+        with self._lock:
+            self._words = words
+            self._labels = labels
+            self._fuzzy = fuzzy
+            self._built_at = time.monotonic()
+
+    @staticmethod
+    def _file_prefix(fuzzy: Dict[str, Set[str]], prefix: str):
+        for key in _deletions(prefix, _key_budget(len(prefix))):
+            fuzzy.setdefault(key, set()).add(prefix)
+
+    def is_stale(self) -> bool:
+        return self._built_at is None or time.monotonic() - self._built_at > REFRESH_SECONDS
+
+    async def refresh(self, pool):
+        """
+        Rebuild through pool (db_pool) in the background once stale, one
+        rebuild at a time. Lookups keep the old index until the new one is
+        swapped in; only callers arriving before the first build wait.
+        """
+        if not self.is_stale():
+            return
+        loop = asyncio.get_running_loop()
+        if self._refresh is None or self._refresh.done() or self._refresh.get_loop() is not loop:
+            self._refresh = asyncio.ensure_future(pool.call(self.build))
+            self._refresh.add_done_callback(self._refreshed)
+        if self._built_at is None:
+            await asyncio.shield(self._refresh)
+
+    @staticmethod
+    def _refreshed(task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error rebuilding suggestion index: {task.exception()}")
+
+    def add(self, kind: str, entry_id: int, label: str):
+        with self._lock:
+            if self._built_at is None:
+                return  # The first build will pick it up
+            self._remove_locked(kind, entry_id)
+            self._labels[(kind, entry_id)] = label
+            for word in set(_tokens(label)):
+                insort(self._words, (word, kind, entry_id))
+                # Removals leave their prefixes behind; they find no words
+                # and are dropped by the next build
+                for length in range(FUZZY_MIN_LENGTH, min(len(word), FUZZY_KEY_LENGTH) + 1):
+                    self._file_prefix(self._fuzzy, word[:length])
+
+    def remove(self, kind: str, entry_id: int):
+        with self._lock:
+            self._remove_locked(kind, entry_id)
+
+    def _remove_locked(self, kind: str, entry_id: int):
+        label = self._labels.pop((kind, entry_id), None)
+        if label is None:
+            return
+        for word in set(_tokens(label)):
+            i = bisect_left(self._words, (word, kind, entry_id))
+            if i < len(self._words) and self._words[i] == (word, kind, entry_id):
+                del self._words[i]
+
+    # Hooks called from models/cleanup when the catalog changes
+    def product_listed(self, product):
+        if not product.is_sold:
+            self.add("product", product.id, product.name)
+
+    def product_removed(self, product_id: int):
+        self.remove("product", product_id)
+
+    def _span(self, prefix: str) -> Tuple[int, int]:
+        """Positions in _words of the words starting with prefix"""
+        return bisect_left(self._words, (prefix,)), bisect_left(self._words, (prefix + chr(sys.maxunicode),))
+
+    def _scan(self, prefix: str, hits: dict, wanted: int, accept, allowance: int) -> int:
+        """
+        Add (kind, id) -> distance for words starting with prefix until hits
+        holds wanted entries or allowance words were examined, and return how
+        many were. accept(word, label) returns a distance or None.
+        """
+        start, end = self._span(prefix)
+        end = min(end, start + allowance)
+        i = start
+        while i < end and len(hits) < wanted:
+            word, kind, entry_id = self._words[i]
+            i += 1
+            if (kind, entry_id) in hits:
+                continue
+            distance = accept(word, self._labels[(kind, entry_id)])
+            if distance is not None:
+                hits[(kind, entry_id)] = distance
+        return i - start
+
+    def _fuzzy_prefixes(self, prefix: str, budget: int) -> List[Tuple[int, str]]:
+        """(distance, indexed prefix) pairs to scan for a misspelt prefix, closest first"""
+        key = prefix[:FUZZY_KEY_LENGTH]
+        if len(prefix) >= FUZZY_KEY_LENGTH:
+            # Compared on the first 7 letters only, where one inserted or
+            # dropped letter can cost two; words are checked in full later
+            lengths = (FUZZY_KEY_LENGTH,)
+            budget = _key_budget(FUZZY_KEY_LENGTH)
+        else:
+            lengths = (len(prefix) - 1, len(prefix), len(prefix) + 1)
+        candidates = set()
+        for deletion in _deletions(key, budget):
+            candidates |= self._fuzzy.get(deletion, set())
+        found = []
+        for candidate in candidates:
+            if len(candidate) in lengths:
+                distance = _edit_distance(key, candidate, budget)
+                if distance <= budget:
+                    found.append((distance, candidate))
+        found.sort()
+        return found
+
+    def suggest(self, query: str, limit: int = 8) -> List[dict]:
+        """Return up to limit completions for what the user has typed so far"""
+        tokens = _tokens(query)
+        if not tokens:
+            return []
+        prefix, others = tokens[-1], set(tokens[:-1])
+        budget = _typo_budget(prefix)
+
+        def matches_others(label):
+            if not others:
+                return True
+            words = _tokens(label)
+            return all(any(w.startswith(t) for w in words) for t in others)
+
+        def typo_distance(word):
+            distance = min(
+                _edit_distance(prefix, word[:len(prefix) + delta], budget)
+                for delta in (-1, 0, 1)
+            )
+            return distance if distance <= budget else None
+
+        # Collect a few more than limit so ranking still has a choice
+        wanted = limit * 2
+        with self._lock:
+            hits = {}
+            spans = [self._span(token) for token in others]
+            if any(start == end for start, end in spans):
+                return []  # Earlier words must match exactly, and one matches nothing
+            start, end = min(spans, key=lambda span: span[1] - span[0], default=(0, 0))
+            if spans and end - start <= MAX_SCAN_WORDS:
+                # Fewer entries have the earlier words than the last one, so
+                # check those entries instead of scanning for the last word
+                for _, kind, entry_id in self._words[start:end]:
+                    label = self._labels[(kind, entry_id)]
+                    if (kind, entry_id) in hits or not matches_others(label):
+                        continue
+                    distances = [
+                        0 if word.startswith(prefix) else typo_distance(word) if budget else None
+                        for word in _tokens(label)
+                    ]
+                    distances = [d for d in distances if d is not None]
+                    if distances:
+                        hits[(kind, entry_id)] = min(distances)
+            else:
+                examined = self._scan(
+                    prefix, hits, wanted, lambda word, label: 0 if matches_others(label) else None,
+                    MAX_SCAN_WORDS
+                )
+                if len(hits) < limit and budget:
+                    def accept_typo(word, label):
+                        distance = typo_distance(word)
+                        return distance if distance is not None and matches_others(label) else None
+
+                    for _, candidate in self._fuzzy_prefixes(prefix, budget):
+                        if len(hits) >= wanted or examined >= MAX_LOOKUP_WORDS:
+                            break
+                        examined += self._scan(
+                            candidate, hits, wanted, accept_typo, min(MAX_SCAN_WORDS, MAX_LOOKUP_WORDS - examined)
+                        )
+
+            candidates = [
+                (distance, kind, entry_id, self._labels[(kind, entry_id)])
+                for (kind, entry_id), distance in hits.items()
+            ]
+
+        lowered = " ".join(tokens)
+        candidates.sort(key=lambda c: (
+            c[0],
+            not c[3].lower().startswith(lowered),
+            c[1] != "category",
+            len(c[3]),
+            c[3].lower()
+        ))
+        return [
+            {
+                "type": kind,
+                "id": entry_id,
+                "label": label,
+                "url": f"/{kind}/{entry_id}"
+            }
+            for _, kind, entry_id, label in candidates[:limit]
+        ]
+
+suggestion_index = SuggestionIndex()
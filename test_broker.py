@@ -0,0 +1,83 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import pytest
+from websockets.sync.client import connect
+from broker import SQLiteBroker
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"worker on port {port} did not start")
+
+@pytest.fixture
+def workers(tmp_path):
+    """Three app workers sharing one database and one broker file"""
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{tmp_path / 'app.db'}",
+        WS_BROKER_URL=f"sqlite:///{tmp_path / 'broker.db'}",
+    )
+    ports = [free_port() for _ in range(3)]
+    processes = []
+    try:
+        for port in ports:
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+                cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            ))
+        for port in ports:
+            wait_for_port(port)
+        yield ports
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+def test_messages_reach_users_on_other_workers(workers):
+    first, second, third = workers
+    with connect(f"ws://127.0.0.1:{first}/ws/2") as receiver, \
+         connect(f"ws://127.0.0.1:{second}/ws/2") as receiver_other_tab, \
+         connect(f"ws://127.0.0.1:{third}/ws/1") as sender:
+        sender.send(json.dumps({"sender_id": 1, "receiver_id": 2, "content": "cross-worker hello"}))
+        
+        assert json.loads(sender.recv(timeout=5))["content"] == "cross-worker hello"
+        assert json.loads(receiver.recv(timeout=5))["content"] == "cross-worker hello"
+        assert json.loads(receiver_other_tab.recv(timeout=5))["content"] == "cross-worker hello"
+
+def test_broker_skips_its_own_events(tmp_path):
+    url = f"sqlite:///{tmp_path / 'broker.db'}"
+    one, two = SQLiteBroker(url, poll_interval=0.01), SQLiteBroker(url, poll_interval=0.01)
+    received = {"one": [], "two": []}
+    
+    def deliver_to(name):
+        async def deliver(message, user_id):
+            received[name].append((user_id, message))
+        return deliver
+    
+    async def run():
+        await one.start(deliver_to("one"))
+        await two.start(deliver_to("two"))
+        await one.publish(7, "ping")
+        await asyncio.sleep(0.2)
+        await one.stop()
+        await two.stop()
+    
+    asyncio.run(run())
+    assert received == {"one": [], "two": [(7, "ping")]}
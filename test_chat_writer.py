@@ -0,0 +1,67 @@
+import asyncio
+import json
+import pytest
+from sqlalchemy.orm import sessionmaker
+import models
+import schemas
+from chat_writer import MessageWriter
+
+@pytest.fixture
+def users(db):
+    return [
+        models.create_user(db, schemas.UserCreate(
+            email=f"user{i}@campus.edu", password="x", full_name=f"User {i}", university="Campus"
+        ))
+        for i in range(2)
+    ]
+
+def test_burst_is_group_committed(db, db_engine, users):
+    alice, bob = users
+    writer = MessageWriter(sessionmaker(bind=db_engine), max_batch=50)
+    
+    async def burst():
+        sends = [
+            writer.submit(schemas.MessageCreate(sender_id=alice.id, receiver_id=bob.id, content=f"m{i}"))
+            for i in range(120)
+        ]
+        saved = await asyncio.gather(*sends)
+        await writer.close()
+        return saved
+    
+    saved = asyncio.run(burst())
+    assert [m.content for m in saved] == [f"m{i}" for i in range(120)]
+    assert [m.id for m in saved] == sorted(m.id for m in saved)
+    assert all(m.created_at is not None for m in saved)
+    assert writer.messages == 120 and writer.batches <= 4
+    
+    inbox = models.get_user_conversations(db, bob.id)
+    assert inbox[alice.id]["unread_count"] == 120
+    assert inbox[alice.id]["last_message"].content == "m119"
+
+def test_failed_batch_reaches_every_submitter(db_engine, users):
+    alice, bob = users
+    writer = MessageWriter(sessionmaker(bind=db_engine))
+    def failing_flush(messages):
+        raise RuntimeError("disk full")
+    writer._flush = failing_flush
+    
+    async def send():
+        try:
+            with pytest.raises(RuntimeError):
+                await writer.submit(schemas.MessageCreate(sender_id=alice.id, receiver_id=bob.id, content="hi"))
+        finally:
+            await writer.close()
+    
+    asyncio.run(send())
+
+def test_websocket_messages_go_through_writer(client, db_engine, users, monkeypatch):
+    import app as app_module
+    alice, bob = users
+    writer = MessageWriter(sessionmaker(bind=db_engine))
+    monkeypatch.setattr(app_module, "message_writer", writer)
+    
+    with client.websocket_connect(f"/ws/{alice.id}") as websocket:
+        websocket.send_text(json.dumps({"sender_id": alice.id, "receiver_id": bob.id, "content": "hello"}))
+        echoed = json.loads(websocket.receive_text())
+    assert echoed["content"] == "hello" and echoed["id"]
+    assert writer.messages == 1
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import pytest
+from connections import ConnectionManager, CLOSE_GOING_AWAY, CLOSE_TOO_SLOW
+
+class FakeSocket:
+    """Records frames; a blocked socket never finishes a send until released"""
+
+    def __init__(self, blocked=False):
+        self.sent = []
+        self.closed_with = None
+        self.release = asyncio.Event()
+        if not blocked:
+            self.release.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message):
+        await self.release.wait()
+        self.sent.append(message)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_slow_client_does_not_delay_others():
+    async def scenario():
+        manager = ConnectionManager(max_queue=10)
+        slow, fast, other_user = FakeSocket(blocked=True), FakeSocket(), FakeSocket()
+        await manager.connect(slow, 1)
+        await manager.connect(fast, 1)
+        await manager.connect(other_user, 2)
+
+        await asyncio.wait_for(manager.deliver_local("hi", 1), 0.1)
+        await asyncio.wait_for(manager.deliver_local("hello", 2), 0.1)
+        await settle()
+        assert fast.sent == ["hi"]
+        assert other_user.sent == ["hello"]
+        assert slow.sent == []
+
+        slow.release.set()
+        await settle()
+        assert slow.sent == ["hi"]
+        assert manager.metrics()["sent"] == 3
+    asyncio.run(scenario())
+
+def test_full_queue_drops_oldest():
+    async def scenario():
+        manager = ConnectionManager(max_queue=3)
+        slow = FakeSocket(blocked=True)
+        await manager.connect(slow, 1)
+        await settle()
+        await manager.deliver_local("0", 1)
+        await settle()
+        for n in range(1, 6):
+            await manager.deliver_local(str(n), 1)
+        metrics = manager.metrics()
+        assert metrics["dropped"] == 2
+        assert metrics["queued"] == 3
+        assert metrics["max_queue_depth"] == 3
+
+        slow.release.set()
+        await settle()
+        # "0" was already in flight when the queue filled up
+        assert slow.sent == ["0", "3", "4", "5"]
+    asyncio.run(scenario())
+
+def test_full_queue_disconnects_slow_client():
+    async def scenario():
+        manager = ConnectionManager(max_queue=2, overflow_policy="disconnect")
+        slow, fast = FakeSocket(blocked=True), FakeSocket()
+        await manager.connect(slow, 1)
+        await manager.connect(fast, 1)
+        await settle()
+        for n in range(4):
+            await manager.deliver_local(str(n), 1)
+            await settle()
+        assert slow.closed_with == CLOSE_TOO_SLOW
+        assert [outbound.websocket for outbound in manager.active_connections[1]] == [fast]
+        assert fast.sent == ["0", "1", "2", "3"]
+        assert manager.metrics()["slow_disconnects"] == 1
+
+        # The endpoint's own disconnect afterwards is harmless
+        manager.disconnect(slow, 1)
+    asyncio.run(scenario())
+
+def test_failed_send_removes_connection():
+    async def scenario():
+        class BrokenSocket(FakeSocket):
+            async def send_text(self, message):
+                raise RuntimeError("connection reset")
+
+        manager = ConnectionManager()
+        await manager.connect(BrokenSocket(), 1)
+        await manager.deliver_local("hi", 1)
+        await settle()
+        assert manager.active_connections == {}
+    asyncio.run(scenario())
+
+def test_unknown_policy_rejected():
+    with pytest.raises(ValueError):
+        ConnectionManager(overflow_policy="block")
+
+def test_heartbeat_pings_and_reaps_silent_sockets():
+    async def scenario():
+        manager = ConnectionManager(ping_interval=10, ping_timeout=5, idle_timeout=0)
+        answering, silent = FakeSocket(), FakeSocket()
+        answering_outbound = await manager.connect(answering, 1, heartbeat=True)
+        silent_outbound = await manager.connect(silent, 2, heartbeat=True)
+
+        manager.sweep()
+        await settle()
+        assert json.loads(answering.sent[-1]) == {"type": "ping"}
+        assert json.loads(silent.sent[-1]) == {"type": "ping"}
+
+        # Only one of them answers before the timeout runs out
+        answering_outbound.heard(heartbeat=True)
+        silent_outbound.last_seen -= 16
+        manager.sweep()
+        await settle()
+        assert list(manager.active_connections) == [1]
+        assert silent.closed_with == CLOSE_GOING_AWAY
+        assert manager.metrics()["reaped"] == 1
+    asyncio.run(scenario())
+
+def test_clients_without_heartbeat_are_not_pinged_or_reaped_for_silence():
+    async def scenario():
+        manager = ConnectionManager(ping_interval=10, ping_timeout=5, idle_timeout=0)
+        legacy = FakeSocket()
+        outbound = await manager.connect(legacy, 1)
+        outbound.last_seen -= 1000
+        manager.sweep()
+        await settle()
+        assert list(manager.active_connections) == [1]
+        assert legacy.sent == []
+    asyncio.run(scenario())
+
+def test_idle_sockets_are_reaped_despite_pongs():
+    async def scenario():
+        manager = ConnectionManager(ping_interval=10, ping_timeout=5, idle_timeout=60)
+        outbound = await manager.connect(FakeSocket(), 1)
+        outbound.last_active -= 61
+        outbound.heard(heartbeat=True)
+        manager.sweep()
+        await settle()
+        assert manager.active_connections == {}
+    asyncio.run(scenario())
+
+def test_per_user_cap_closes_oldest_tab():
+    async def scenario():
+        manager = ConnectionManager(max_per_user=2)
+        tabs = [FakeSocket() for _ in range(3)]
+        for tab in tabs:
+            await manager.connect(tab, 1)
+        await settle()
+        assert tabs[0].closed_with == CLOSE_GOING_AWAY
+        assert [outbound.websocket for outbound in manager.active_connections[1]] == tabs[1:]
+        assert manager.metrics()["evicted"] == 1
+    asyncio.run(scenario())
+
+def test_worker_cap_refuses_new_sockets():
+    async def scenario():
+        manager = ConnectionManager(max_connections=2)
+        assert await manager.connect(FakeSocket(), 1)
+        assert await manager.connect(FakeSocket(), 2)
+        refused = FakeSocket()
+        assert await manager.connect(refused, 3) is None
+        assert refused.closed_with == CLOSE_TOO_SLOW
+        assert manager.connection_count() == 2
+        assert manager.metrics()["rejected"] == 1
+    asyncio.run(scenario())
+
+def test_endpoint_error_releases_connection(client, monkeypatch):
+    import app as app_module
+    manager = ConnectionManager()
+    monkeypatch.setattr(app_module, "manager", manager)
+
+    with client.websocket_connect("/ws/1") as websocket:
+        websocket.send_text("not json")
+    assert manager.active_connections == {}
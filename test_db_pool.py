@@ -0,0 +1,53 @@
+import asyncio
+import time
+from db_pool import DBPool
+
+def slow_query(seconds):
+    time.sleep(seconds)
+    return seconds
+
+def test_slow_calls_do_not_block_the_loop():
+    pool = DBPool(max_workers=4)
+
+    async def scenario():
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+        task = asyncio.ensure_future(ticker())
+        started = time.monotonic()
+        results = await asyncio.gather(*(pool.run(slow_query, 0.2) for _ in range(4)))
+        elapsed = time.monotonic() - started
+        task.cancel()
+        return results, elapsed, ticks
+
+    results, elapsed, ticks = asyncio.run(scenario())
+    assert results == [0.2] * 4
+    # Four calls overlapped on the pool while the loop kept ticking
+    assert elapsed < 0.6
+    assert ticks >= 10
+    assert pool.metrics() == {"workers": 4, "calls": 4, "pending": 0}
+
+def test_inline_pool_runs_on_the_loop():
+    pool = DBPool(max_workers=0)
+    assert asyncio.run(pool.run(slow_query, 0)) == 0
+
+def test_call_gets_a_session_of_its_own():
+    sessions = []
+    class FakeSession:
+        closed = False
+        def close(self):
+            self.closed = True
+    def factory():
+        sessions.append(FakeSession())
+        return sessions[-1]
+    pool = DBPool(session_factory=factory, max_workers=2)
+
+    async def scenario():
+        return await asyncio.gather(pool.call(lambda db: db), pool.call(lambda db: db))
+
+    first, second = asyncio.run(scenario())
+    assert first is not second
+    assert all(session.closed for session in sessions)
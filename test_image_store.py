@@ -0,0 +1,146 @@
+import os
+import pytest
+import models
+import schemas
+import image_store
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(image_store.IMAGE_ROOT)
+    return image_store.IMAGE_ROOT
+
+def stored(store, data, extension=".jpg"):
+    temp_path = os.path.join(store, ".upload-test")
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    return image_store.commit_file(temp_path, image_store.file_digest(temp_path), extension, store)
+
+def listing(db, seller, category, image_url, name="Desk lamp"):
+    return models.create_product(db, schemas.ProductCreate(
+        name=name, description="", price=12, condition="Good",
+        image_url=image_url, seller_id=seller.id, category_id=category.id
+    ))
+
+def test_shared_image_survives_until_last_reference(db, seller, category, store):
+    url = image_store.url_for_name(stored(store, b"lamp"))
+    first = listing(db, seller, category, url)
+    second = listing(db, seller, category, url, name="Same lamp")
+
+    db.delete(first)
+    db.commit()
+    assert image_store.release(db, [url]) == 0
+    assert os.path.exists(image_store.path_for_url(url))
+
+    db.delete(second)
+    db.commit()
+    assert image_store.release(db, [url]) == 1
+    assert list(image_store.iter_files()) == []
+
+def test_migrate_flat_files(db, seller, category, store):
+    for name in ("a.jpg", "b.jpg", "a-card.webp"):
+        with open(os.path.join(store, name), "wb") as f:
+            f.write(b"card" if name.endswith(".webp") else b"lamp")
+    first = listing(db, seller, category, "/static/images/products/a.jpg")
+    first.card_url = "/static/images/products/a-card.webp"
+    db.commit()
+    second = listing(db, seller, category, "/static/images/products/b.jpg", name="Same lamp")
+
+    assert image_store.migrate_flat_files(db) == 2
+    digest = image_store.file_digest(image_store.path_for_url(first.image_url))
+    # Both uploads had the same bytes, so they now share one file
+    assert first.image_url == second.image_url == image_store.url_for_name(image_store.shard_name(digest, ".jpg"))
+    assert first.card_url == image_store.url_for_name(image_store.shard_name(digest, "-card.webp"))
+    assert sorted(image_store.iter_files()) == sorted([
+        image_store.shard_name(digest, ".jpg"), image_store.shard_name(digest, "-card.webp")
+    ])
+    # A second run finds nothing left to move
+    assert image_store.migrate_flat_files(db) == 0
+
+def test_release_forgets_the_rows(db, seller, category, store):
+    url = image_store.url_for_name(stored(store, b"lamp"))
+    product = listing(db, seller, category, url)
+    image_store.register(db, [url], product.id)
+    assert models.get_image_totals(db) == (1, 4)
+
+    db.delete(product)
+    db.commit()
+    image_store.release(db, [url])
+    assert models.get_image_totals(db) == (0, 0)
+
+@pytest.fixture
+def cleanup_db(db_engine, monkeypatch):
+    import cleanup
+    from sqlalchemy.orm import sessionmaker
+    monkeypatch.setattr(cleanup, "SessionLocal", sessionmaker(bind=db_engine))
+    return cleanup
+
+def test_orphans_come_from_the_images_table(db, seller, category, store, cleanup_db):
+    kept = image_store.url_for_name(stored(store, b"lamp"))
+    orphan = image_store.url_for_name(stored(store, b"gone"))
+    image_store.register(db, [kept], listing(db, seller, category, kept).id)
+    image_store.register(db, [orphan])
+
+    # Too new: its product may still be on the way
+    assert cleanup_db.cleanup_orphaned_images() == 0
+    assert cleanup_db.cleanup_orphaned_images(min_age_hours=-1) == 1
+    assert not os.path.exists(image_store.path_for_url(orphan))
+    assert [path for path, in db.query(models.StoredImage.path)] == [kept]
+
+def test_storage_stats_read_the_images_table(db, seller, category, store, cleanup_db):
+    url = image_store.url_for_name(stored(store, b"x" * 1024 * 1024))
+    image_store.register(db, [url], listing(db, seller, category, url).id)
+    # A file the table does not know about is not counted until reconciled
+    stored(store, b"unrecorded")
+
+    stats = cleanup_db.get_storage_stats()
+    assert (stats["total_products"], stats["active_products"], stats["sold_products"]) == (1, 1, 0)
+    assert (stats["total_images"], stats["storage_size_mb"]) == (1, 1.0)
+
+def test_reconcile(db, store):
+    recorded = image_store.url_for_name(stored(store, b"lamp"))
+    image_store.register(db, [recorded])
+    unrecorded = image_store.url_for_name(stored(store, b"chair"))
+    os.remove(image_store.path_for_url(recorded))
+
+    assert image_store.reconcile(db) == (1, 1)
+    assert [path for path, in db.query(models.StoredImage.path)] == [unrecorded]
+    assert image_store.reconcile(db) == (0, 0)
+
+def test_release_waits_for_an_upload_sharing_the_file(db, db_engine, seller, category, store):
+    import threading
+    from sqlalchemy.orm import sessionmaker
+    url = image_store.url_for_name(stored(store, b"lamp"))
+    old = listing(db, seller, category, url)
+    db.delete(old)
+    db.commit()
+
+    # A second upload of the same bytes dedupes onto the file...
+    temp_path = os.path.join(store, ".upload-again")
+    with open(temp_path, "wb") as f:
+        f.write(b"lamp")
+    results = []
+    with image_store.storing(temp_path, image_store.file_digest(temp_path), ".jpg", store) as shared_url:
+        # ...while the old listing's release runs on another thread
+        other = sessionmaker(bind=db_engine)()
+        releaser = threading.Thread(target=lambda: results.append(image_store.release(other, [url])))
+        releaser.start()
+        releaser.join(0.2)
+        assert releaser.is_alive()
+        listing(db, seller, category, shared_url, name="Same lamp")
+    releaser.join()
+    other.close()
+
+    assert results == [0]
+    assert os.path.exists(image_store.path_for_url(url))
+
+def test_release_hands_the_rows_to_the_next_product(db, seller, category, store):
+    url = image_store.url_for_name(stored(store, b"lamp"))
+    first = listing(db, seller, category, url)
+    second = listing(db, seller, category, url, name="Same lamp")
+    image_store.register(db, [url], first.id)
+
+    db.delete(first)
+    db.commit()
+    image_store.release(db, [url])
+    assert db.query(models.StoredImage.product_id).scalar() == second.id
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import time
+import pytest
+from sqlalchemy.orm import sessionmaker
+import models
+import schemas
+
+Image = pytest.importorskip("PIL.Image")
+import images
+
+@pytest.fixture
+def photo(tmp_path, monkeypatch):
+    """A 2000x1000 JPEG with camera metadata, saved where uploads go"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("static/images/products")
+    exif = Image.Exif()
+    exif[0x010F] = "PhoneMaker"  # Make
+    exif[0x0112] = 6  # Orientation: rotate 90 degrees clockwise
+    Image.new("RGB", (2000, 1000), "orange").save("static/images/products/abc.jpg", "JPEG", exif=exif)
+    return "/static/images/products/abc.jpg"
+
+def test_derivatives_are_resized_and_stripped(photo):
+    paths = images.build_derivatives("./static/images/products/abc.jpg")
+    assert set(paths) == {"thumb", "card", "full"}
+    for name, longest in images.DERIVATIVE_SIZES.items():
+        with Image.open(paths[name]) as derivative:
+            assert derivative.format == "WEBP"
+            # Rotated upright from the EXIF orientation, then shrunk
+            assert derivative.size == (longest // 2, longest)
+            assert not derivative.getexif()
+
+@pytest.fixture
+def product(db, seller, category, photo):
+    return models.create_product(db, schemas.ProductCreate(
+        name="Desk lamp", description="", price=12, condition="Good",
+        image_url=photo, seller_id=seller.id, category_id=category.id
+    ))
+
+def test_new_upload_gets_derivative_urls(db, db_engine, product, monkeypatch):
+    from db_pool import db_pool
+    monkeypatch.setattr(db_pool, "session_factory", sessionmaker(bind=db_engine))
+    images.start_pool()
+    try:
+        asyncio.run(images.process_product_image(product.id, product.image_url))
+    finally:
+        images.stop_pool()
+
+    db.refresh(product)
+    assert product.card_url == "/static/images/products/abc-card.webp"
+    assert os.path.exists(product.thumb_url.lstrip("/"))
+
+def test_backfill_covers_existing_images(db, product):
+    assert images.backfill(db) == 1
+    db.refresh(product)
+    assert product.full_url == "/static/images/products/abc-full.webp"
+    # Nothing left to do on a second run
+    assert images.backfill(db) == 0
+
+def test_orphan_cleanup_keeps_derivatives(db, db_engine, product, monkeypatch):
+    import cleanup
+    monkeypatch.setattr(cleanup, "SessionLocal", sessionmaker(bind=db_engine))
+    images.backfill(db)
+    open("static/images/products/stale.jpg", "wb").close()
+    open("static/images/products/.upload-inflight", "wb").close()
+    # Only files older than the grace period count as orphans
+    a_day_ago = time.time() - 86400
+    os.utime("static/images/products/stale.jpg", (a_day_ago, a_day_ago))
+
+    assert cleanup.cleanup_orphaned_images(reconcile=True) == 1
+    assert sorted(os.listdir("static/images/products")) == [
+        ".locks", ".upload-inflight", "abc-card.webp", "abc-full.webp", "abc-thumb.webp", "abc.jpg"
+    ]
+
+def test_derivatives_are_recorded(db, product):
+    images.backfill(db)
+    rows = {row.path: row for row in db.query(models.StoredImage)}
+    card = rows["/static/images/products/abc-card.webp"]
+    assert (card.width, card.height) == (240, 480)
+    assert card.product_id == product.id
+    assert card.bytes == os.path.getsize("static/images/products/abc-card.webp")
+
+def test_oversized_source_is_refused(photo, monkeypatch):
+    monkeypatch.setattr(images, "MAX_SOURCE_PIXELS", 1000 * 1000)
+    with pytest.raises(ValueError):
+        images.build_derivatives("./static/images/products/abc.jpg")
+    assert os.listdir("static/images/products") == ["abc.jpg"]
+
+def test_pool_does_not_fork_the_app_process():
+    pool = images._new_pool()
+    try:
+        assert pool._mp_context.get_start_method() in ("forkserver", "spawn")
+    finally:
+        pool.shutdown()
+
+def test_pool_is_started_once_and_stopped():
+    images.start_pool()
+    try:
+        pool = images._pool
+        images.start_pool()
+        # Workers are already running before any image arrives
+        assert images._pool is pool and pool._processes
+    finally:
+        images.stop_pool()
+    assert images._pool is None
@@ -0,0 +1,117 @@
+import pytest
+import json
+from sqlalchemy import event
+import models
+import schemas
+from conftest import login
+
+@pytest.fixture
+def users(db):
+    return [
+        models.create_user(db, schemas.UserCreate(
+            email=f"{name}@campus.edu", password="x", full_name=name.title(), university="Campus"
+        ))
+        for name in ("alice", "bob", "carol")
+    ]
+
+def send(db, sender, receiver, content):
+    return models.create_message(db, schemas.MessageCreate(
+        sender_id=sender.id, receiver_id=receiver.id, content=content
+    ))
+
+def test_conversations_follow_new_messages(db, users):
+    alice, bob, carol = users
+    send(db, bob, alice, "Is the lamp still available?")
+    send(db, alice, bob, "Yes")
+    latest = send(db, carol, alice, "Selling your textbook?")
+    send(db, carol, alice, "Hello?")
+    
+    inbox = models.get_user_conversations(db, alice.id)
+    assert list(inbox) == [carol.id, bob.id]
+    assert inbox[carol.id]["user"].full_name == "Carol"
+    assert inbox[carol.id]["last_message"].content == "Hello?"
+    assert inbox[carol.id]["unread_count"] == 2
+    assert inbox[bob.id]["unread_count"] == 0
+    assert models.get_user_conversations(db, carol.id)[alice.id]["unread_count"] == 0
+    
+    models.mark_conversation_read(db, alice.id, carol.id)
+    assert models.get_user_conversations(db, alice.id)[carol.id]["unread_count"] == 0
+    assert latest.id < inbox[carol.id]["last_message"].id
+
+def test_inbox_is_one_query(db, db_engine, users):
+    alice = users[0]
+    for other in users[1:]:
+        for i in range(5):
+            send(db, other, alice, f"message {i}")
+    alice_id = alice.id
+    db.expire_all()
+    
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db_engine, "before_cursor_execute", listener)
+    try:
+        inbox = models.get_user_conversations(db, alice_id)
+        [(c["user"].full_name, c["last_message"].content) for c in inbox.values()]
+    finally:
+        event.remove(db_engine, "before_cursor_execute", listener)
+    assert len(statements) == 1
+
+def test_chat_history_pages_back_from_newest(client, db, users):
+    alice, bob, carol = users
+    for i in range(7):
+        send(db, alice, bob, f"a{i}")
+        send(db, bob, alice, f"b{i}")
+    send(db, carol, alice, "unrelated")
+    login(client, alice)
+    
+    latest = client.get(f"/api/messages/{bob.id}?limit=5")
+    assert [m["content"] for m in latest.json()] == ["b4", "a5", "b5", "a6", "b6"]
+    before_id = latest.headers["X-Next-Before-Id"]
+    
+    older = client.get(f"/api/messages/{bob.id}?limit=5&before_id={before_id}")
+    assert [m["content"] for m in older.json()] == ["a2", "b2", "a3", "b3", "a4"]
+    
+    oldest = client.get(f"/api/messages/{bob.id}?limit=5&before_id={older.headers['X-Next-Before-Id']}")
+    assert [m["content"] for m in oldest.json()] == ["a0", "b0", "a1", "b1"]
+    assert "X-Next-Before-Id" not in oldest.headers
+
+def test_receipts_follow_delivery_and_reads(db, users):
+    alice, bob, carol = users
+    first = send(db, alice, bob, "Still selling the bike?")
+    second = send(db, alice, bob, "I can pick it up today")
+    assert models.get_user_conversations(db, alice.id)[bob.id]["delivered_message_id"] == 0
+    
+    models.mark_delivered(db, bob.id, first.id)
+    receipts = models.get_user_conversations(db, alice.id)[bob.id]
+    assert (receipts["delivered_message_id"], receipts["read_message_id"]) == (first.id, 0)
+    
+    assert models.mark_conversation_read(db, bob.id, alice.id)
+    assert not models.mark_conversation_read(db, bob.id, alice.id)
+    receipts = models.get_user_conversations(db, alice.id)[bob.id]
+    assert (receipts["delivered_message_id"], receipts["read_message_id"]) == (second.id, second.id)
+    
+    # Replying counts as having read what came before
+    send(db, carol, alice, "Hi")
+    reply = send(db, alice, carol, "Hey")
+    assert models.get_user_conversations(db, carol.id)[alice.id]["read_message_id"] == reply.id
+
+def test_reconnect_streams_only_missed_messages(client, db, users):
+    alice, bob, carol = users
+    seen = send(db, alice, bob, "one")
+    send(db, alice, bob, "two")
+    send(db, bob, carol, "sent by bob")
+    send(db, carol, bob, "three")
+    
+    with client.websocket_connect(f"/ws/{bob.id}?last_seen_message_id={seen.id}&heartbeat=1") as websocket:
+        frames = [json.loads(websocket.receive_text()) for _ in range(3)]
+        assert [frame.get("content") for frame in frames[:2]] == ["two", "three"]
+        assert frames[2] == {"type": "synced", "last_message_id": frames[1]["id"]}
+        assert models.get_user_conversations(db, alice.id)[bob.id]["delivered_message_id"] == seen.id
+        
+        websocket.send_text(json.dumps({"type": "ack", "message_id": frames[1]["id"]}))
+        websocket.send_text(json.dumps({"type": "read", "other_user_id": carol.id}))
+        websocket.send_text(json.dumps({"type": "pong"}))
+    
+    db.expire_all()
+    assert models.get_user_conversations(db, alice.id)[bob.id]["delivered_message_id"] == frames[0]["id"]
+    assert models.get_user_conversations(db, carol.id)[bob.id]["read_message_id"] == frames[1]["id"]
@@ -0,0 +1,99 @@
+import os
+import subprocess
+import sys
+from sqlalchemy import create_engine, inspect, text
+import migrations
+
+LEGACY_SCHEMA = [
+    "CREATE TABLE users (id INTEGER NOT NULL, email VARCHAR, hashed_password VARCHAR, full_name VARCHAR, "
+    "university VARCHAR, domain VARCHAR, google_id VARCHAR, picture VARCHAR, "
+    "created_at DATETIME DEFAULT (CURRENT_TIMESTAMP), PRIMARY KEY (id), UNIQUE (google_id))",
+    "CREATE TABLE categories (id INTEGER NOT NULL, name VARCHAR, description VARCHAR, PRIMARY KEY (id))",
+    "CREATE TABLE products (id INTEGER NOT NULL, name VARCHAR, description TEXT, price FLOAT, condition VARCHAR, "
+    "image_url VARCHAR, created_at DATETIME DEFAULT (CURRENT_TIMESTAMP), is_sold INTEGER, category_id INTEGER, "
+    "seller_id INTEGER, PRIMARY KEY (id))",
+    "CREATE TABLE messages (id INTEGER NOT NULL, content TEXT, created_at DATETIME DEFAULT (CURRENT_TIMESTAMP), "
+    "sender_id INTEGER, receiver_id INTEGER, product_id INTEGER, PRIMARY KEY (id))",
+]
+
+def test_migrate_is_idempotent(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    latest = migrations.MIGRATIONS[-1][0]
+    assert migrations.migrate(engine) == [v for v, _, _ in migrations.MIGRATIONS]
+    assert migrations.migrate(engine) == []
+    assert migrations.schema_version(engine) == latest
+
+def test_migrate_upgrades_legacy_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        for statement in LEGACY_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO products (name, is_sold) VALUES ('Old listing', 0)"))
+    
+    migrations.migrate(engine)
+    indexes = {ix["name"] for ix in inspect(engine).get_indexes("products")}
+    assert {"ix_products_sold_created", "ix_products_category_sold_created", "ix_products_seller_created"} <= indexes
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT name FROM products")).scalar() == "Old listing"
+
+def run_concurrent_migrations(path, workers=5):
+    """Start several processes migrating one database at once, like gunicorn workers booting"""
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}")
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-c", "import migrations; migrations.migrate()"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        for _ in range(workers)
+    ]
+    failures = []
+    for process in processes:
+        stderr = process.communicate(timeout=60)[1].decode()
+        if process.returncode != 0:
+            failures.append(stderr)
+    return failures
+
+def test_concurrent_migrations_on_fresh_database(tmp_path):
+    assert run_concurrent_migrations(tmp_path / "fresh.db") == []
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    assert migrations.schema_version(engine) == migrations.MIGRATIONS[-1][0]
+
+def test_concurrent_migrations_on_legacy_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        for statement in LEGACY_SCHEMA:
+            conn.execute(text(statement))
+    assert run_concurrent_migrations(tmp_path / "legacy.db") == []
+    assert migrations.schema_version(engine) == migrations.MIGRATIONS[-1][0]
+
+def test_hot_queries_never_scan_a_table(db_engine):
+    assert migrations.check_query_plans(db_engine) == []
+
+def test_plan_check_catches_missing_index(db_engine):
+    with db_engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_products_seller_created"))
+    problems = migrations.check_query_plans(db_engine)
+    assert ("get_user_products", "SCAN products") in problems
+
+def test_plan_check_catches_sort_outside_the_index(db_engine):
+    with db_engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_products_sold_price"))
+    problems = migrations.check_query_plans(db_engine)
+    assert ("search_products (price range)", "USE TEMP B-TREE FOR ORDER BY") in problems
+
+def test_conversations_backfilled_from_history(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        for statement in LEGACY_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text(
+            "INSERT INTO messages (sender_id, receiver_id, content) VALUES (1, 2, 'hi'), (2, 1, 'hello'), (3, 1, 'hey')"
+        ))
+    
+    migrations.migrate(engine)
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT user_id, other_user_id, last_message_id FROM conversations ORDER BY user_id, other_user_id"
+        )).fetchall()
+    assert [tuple(r) for r in rows] == [(1, 2, 2), (1, 3, 3), (2, 1, 2), (3, 1, 3)]
@@ -0,0 +1,51 @@
+import pytest
+from sqlalchemy import event
+import models
+from conftest import login
+from page_cache import PageCache
+
+@pytest.fixture
+def statements(db_engine):
+    seen = []
+    listener = lambda *args: seen.append(args[2])
+    event.listen(db_engine, "before_cursor_execute", listener)
+    yield seen
+    event.remove(db_engine, "before_cursor_execute", listener)
+
+def test_warm_pages_skip_the_database(client, templates, make_product, category, statements):
+    make_product("Desk lamp")
+    for url in ("/", f"/category/{category.id}"):
+        first = client.get(url)
+        assert first.headers["X-Cache"] == "MISS"
+        statements.clear()
+        second = client.get(url)
+        assert second.headers["X-Cache"] == "HIT"
+        assert second.text == first.text and "Desk lamp" in second.text
+        assert statements == []
+
+def test_catalog_changes_invalidate(client, db, templates, make_product):
+    lamp = make_product("Desk lamp")
+    client.get("/")
+    make_product("Office chair")
+    page = client.get("/")
+    assert page.headers["X-Cache"] == "MISS" and "Office chair" in page.text
+    
+    models.update_product_sold_status(db, lamp.id, is_sold=1)
+    assert "Desk lamp" not in client.get("/").text
+
+def test_logged_in_and_json_requests_bypass_cache(client, templates, seller, make_product):
+    make_product("Desk lamp")
+    assert "X-Cache" not in client.get("/?format=json").headers
+    login(client, seller)
+    assert "X-Cache" not in client.get("/").headers
+
+def test_entries_expire_and_are_bounded(monkeypatch):
+    cache = PageCache(ttl=30, max_entries=2)
+    clock = [100.0]
+    monkeypatch.setattr("page_cache.time.monotonic", lambda: clock[0])
+    cache.set(("a",), b"A")
+    cache.set(("b",), b"B")
+    cache.set(("c",), b"C")
+    assert cache.get(("a",)) is None and cache.get(("c",)) == b"C"
+    clock[0] += 31
+    assert cache.get(("c",)) is None
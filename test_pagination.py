@@ -0,0 +1,56 @@
+import pytest
+import models
+import schemas
+from pagination import encode_cursor, decode_cursor
+
+def walk(fetch, **kwargs):
+    """Follow next_cursor to the end, returning the pages seen"""
+    pages = []
+    cursor = None
+    while True:
+        products, cursor = fetch(cursor=cursor, **kwargs)
+        pages.append([p.id for p in products])
+        if cursor is None:
+            return pages
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(["2026-01-01 10:00:00", 42])
+    assert decode_cursor(cursor) == ["2026-01-01 10:00:00", 42]
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor!")
+    for values in ([[1], {}], [True, 1]):
+        with pytest.raises(ValueError):
+            decode_cursor(encode_cursor(values))
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, length=3)
+
+def test_crafted_cursor_is_a_400(client, category, templates):
+    response = client.get(f"/category/{category.id}?format=json&cursor={encode_cursor([[1], {}])}")
+    assert response.status_code == 400
+
+def test_pages_cover_listing_once_newest_first(db, seller, category, make_product):
+    # Created within the same second, so the id tie-breaker does the work
+    ids = [make_product(f"Item {i}").id for i in range(7)]
+    
+    pages = walk(models.get_products_by_category, db=db, category_id=category.id, limit=3)
+    assert pages == [ids[::-1][0:3], ids[::-1][3:6], ids[::-1][6:]]
+    assert walk(models.get_user_products, db=db, user_id=seller.id, limit=4) == [ids[::-1][:4], ids[::-1][4:]]
+    assert walk(models.get_products_by_domain, db=db, domain="campus.edu", limit=10) == [ids[::-1]]
+
+def test_search_cursor_follows_sort(db, make_product):
+    for price in (300, 100, 200, 100):
+        make_product("Notes", price=price)
+    
+    filters = schemas.ProductFilters(sort="price_asc")
+    pages = walk(models.search_products, db=db, query="notes", filters=filters, limit=3)
+    prices = [db.get(models.Product, i).price for page in pages for i in page]
+    assert prices == [100, 100, 200, 300] and len(pages) == 2
+
+def test_cursor_survives_new_listings(db, category, make_product):
+    for i in range(4):
+        make_product(f"Old {i}")
+    first, cursor = models.get_products_by_category(db, category.id, limit=2)
+    make_product("Brand new")
+    second, _ = models.get_products_by_category(db, category.id, cursor=cursor, limit=2)
+    assert not {p.id for p in first} & {p.id for p in second}
+    assert "Brand new" not in [p.name for p in second]
@@ -0,0 +1,65 @@
+import asyncio
+import time
+from fastapi import HTTPException
+import models
+from passwords import PasswordHasher
+
+def test_hash_and_verify():
+    hasher = PasswordHasher(rounds=4)
+    hashed = asyncio.run(hasher.hash("hunter22"))
+    assert asyncio.run(hasher.verify("hunter22", hashed)) == (True, None)
+    assert asyncio.run(hasher.verify("wrong", hashed)) == (False, None)
+    assert asyncio.run(hasher.verify("hunter22", None)) == (False, None)
+
+def test_hashing_leaves_the_loop_free():
+    hasher = PasswordHasher(rounds=10, max_workers=2)
+
+    async def scenario():
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.005)
+                ticks += 1
+        task = asyncio.ensure_future(ticker())
+        started = time.monotonic()
+        await asyncio.gather(*(hasher.hash("pw") for _ in range(4)))
+        elapsed = time.monotonic() - started
+        task.cancel()
+        return ticks, elapsed
+
+    ticks, elapsed = asyncio.run(scenario())
+    # The loop kept ticking at close to its normal rate throughout
+    assert ticks >= elapsed / 0.005 * 0.5
+    assert hasher.metrics()["peak_pending"] == 4 and hasher.metrics()["pending"] == 0
+
+def test_burst_beyond_the_queue_is_turned_away():
+    hasher = PasswordHasher(rounds=4, max_workers=1, max_waiting=1)
+
+    async def scenario():
+        return await asyncio.gather(*(hasher.hash("pw") for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert [isinstance(result, HTTPException) for result in results] == [False, False, True]
+    assert results[2].status_code == 503
+    assert hasher.metrics()["rejected"] == 1
+
+def test_login_upgrades_outdated_hash(client, db, monkeypatch):
+    import app as app_module
+    monkeypatch.setattr(app_module, "password_hasher", PasswordHasher(rounds=4))
+    response = client.post("/register", data={
+        "email": "dana@campus.edu", "password": "correct horse", "full_name": "Dana", "university": "Campus"
+    }, follow_redirects=False)
+    assert response.status_code == 303
+    old_hash = models.get_user_by_email(db, "dana@campus.edu").hashed_password
+    assert old_hash.startswith("$2b$04$")
+
+    upgraded = PasswordHasher(rounds=5)
+    monkeypatch.setattr(app_module, "password_hasher", upgraded)
+    response = client.post("/token", data={"username": "dana@campus.edu", "password": "correct horse"}, follow_redirects=False)
+    assert response.status_code == 303 and "access_token" in response.cookies
+
+    db.expire_all()
+    new_hash = models.get_user_by_email(db, "dana@campus.edu").hashed_password
+    assert new_hash.startswith("$2b$05$")
+    assert upgraded.metrics()["rehashed"] == 1
@@ -0,0 +1,55 @@
+import pytest
+from sqlalchemy import event
+import models
+import schemas
+from conftest import login
+
+ROUTES = ["/", "/category/{category}", "/search?q=textbook", "/my-products", "/community", "/product/{product}"]
+
+def seed(db, seller, category, start, count):
+    """
+    Listed products alternating between the logged-in seller and new sellers,
+    and between the shared category and new ones, so every page has several
+    distinct related rows to load.
+    """
+    products = []
+    for i in range(start, start + count):
+        owner = seller if i % 2 else models.create_user(db, schemas.UserCreate(
+            email=f"seller{i}@campus.edu", password="x", full_name=f"Seller {i}", university="Campus"
+        ))
+        own_category = models.Category(name=f"Category {i}", description="")
+        db.add(own_category)
+        db.commit()
+        products.append(models.create_product(db, schemas.ProductCreate(
+            name=f"Used textbook {i}", description="", price=10, condition="Good",
+            image_url="/static/images/products/x.jpg", seller_id=owner.id,
+            category_id=category.id if i % 3 else own_category.id
+        )))
+    return products
+
+def count_statements(client, engine, url):
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert response.status_code == 200, (url, response.text)
+    return len(statements)
+
+@pytest.mark.parametrize("route", ROUTES)
+def test_statements_per_route_do_not_grow_with_rows(route, client, db, db_engine, seller, category, templates):
+    product = seed(db, seller, category, 0, 3)[0]
+    login(client, seller)
+    url = route.format(category=category.id, product=product.id)
+    cold = count_statements(client, db_engine, url)
+    few = count_statements(client, db_engine, url)
+    
+    seed(db, seller, category, 3, 12)
+    many = count_statements(client, db_engine, url)
+    
+    # page data (+ category, facets, community members); the current user
+    # is only loaded on the first request, later ones hit user_cache
+    assert many == few
+    assert few <= 3 and cold == few + 1
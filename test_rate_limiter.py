@@ -0,0 +1,91 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+import pytest
+from fastapi import HTTPException
+import rate_limiter
+from rate_limiter import RateLimiter, SQLiteRateLimiter
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(rate_limiter.time, "time", lambda: now[0])
+    return now
+
+def test_burst_then_steady_rate(clock):
+    limiter = RateLimiter(requests_per_minute=60)
+    for _ in range(60):
+        assert limiter.check_rate_limit("1.2.3.4")
+    with pytest.raises(HTTPException) as excinfo:
+        limiter.check_rate_limit("1.2.3.4")
+    assert excinfo.value.status_code == 429
+    # Other clients have budgets of their own
+    assert limiter.check_rate_limit("5.6.7.8")
+    
+    # One request's worth of budget comes back every second
+    clock[0] += 1
+    assert limiter.check_rate_limit("1.2.3.4")
+    with pytest.raises(HTTPException):
+        limiter.check_rate_limit("1.2.3.4")
+
+def test_one_float_per_key(clock):
+    limiter = RateLimiter(requests_per_minute=60)
+    for _ in range(30):
+        limiter.check_rate_limit("1.2.3.4")
+    assert limiter.requests == {"1.2.3.4": clock[0] + 30}
+
+def test_idle_keys_are_evicted(clock):
+    limiter = RateLimiter(requests_per_minute=60, sweep_interval=60)
+    for n in range(1000):
+        limiter.check_rate_limit(f"10.0.{n // 256}.{n % 256}")
+    clock[0] += 30
+    limiter.check_rate_limit("1.2.3.4")
+    assert len(limiter.requests) == 1001
+    
+    clock[0] += 31
+    limiter.check_rate_limit("1.2.3.4")
+    assert list(limiter.requests) == ["1.2.3.4"]
+
+def hammer(url, attempts):
+    limiter = SQLiteRateLimiter(url, requests_per_minute=20)
+    allowed = 0
+    for _ in range(attempts):
+        try:
+            limiter.check_rate_limit("1.2.3.4")
+            allowed += 1
+        except HTTPException:
+            pass
+    return allowed
+
+def test_shared_limit_holds_across_processes(tmp_path):
+    url = f"sqlite:///{tmp_path / 'limits.db'}"
+    SQLiteRateLimiter(url)
+    with multiprocessing.get_context("fork").Pool(4) as pool:
+        allowed = pool.starmap(hammer, [(url, 25)] * 4)
+    # One burst of 20 between all four workers (plus a refill if the run took >3s),
+    # not 20 each
+    assert 20 <= sum(allowed) <= 21
+    assert all(count < 25 for count in allowed)
+
+def test_shared_limiter_evicts_recovered_keys(tmp_path):
+    limiter = SQLiteRateLimiter(f"sqlite:///{tmp_path / 'limits.db'}", requests_per_minute=60)
+    limiter.check_rate_limit("1.2.3.4")
+    limiter.evict_idle(time.time() + 2)
+    with limiter.engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM rate_limits").scalar() == 0
+
+def test_shared_check_runs_off_the_loop(tmp_path):
+    limiter = SQLiteRateLimiter(f"sqlite:///{tmp_path / 'limits.db'}", requests_per_minute=1)
+    threads = []
+    check_rate_limit = limiter.check_rate_limit
+    
+    def recording(ip):
+        threads.append(threading.current_thread())
+        return check_rate_limit(ip)
+    
+    limiter.check_rate_limit = recording
+    assert asyncio.run(limiter.check("1.2.3.4"))
+    with pytest.raises(HTTPException):
+        asyncio.run(limiter.check("1.2.3.4"))
+    assert threading.main_thread() not in threads
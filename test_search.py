@@ -0,0 +1,129 @@
+from sqlalchemy import text
+import models
+import schemas
+import search
+
+def results(db, query, filters=None):
+    return models.search_products(db, query, filters)[0]
+
+def test_match_query_is_sanitised():
+    assert search.build_match_query('calc "ti-84" OR') == '"calc" "ti" "84" "OR"*'
+    assert search.build_match_query("  ?!  ") == ""
+
+def test_search_ranks_name_hits_first(db, make_product):
+    make_product("Desk lamp", "Bright lamp, pairs well with a calculus textbook")
+    make_product("Calculus textbook", "Stewart, 8th edition")
+    
+    assert [p.name for p in results(db, "calculus")] == ["Calculus textbook", "Desk lamp"]
+
+def test_search_prefix_and_pagination(db, make_product):
+    for i in range(5):
+        make_product(f"Notebook {i}", "Ruled A4")
+    
+    assert len(results(db, "note")) == 5
+    first, cursor = models.search_products(db, "notebook", limit=3)
+    second, end = models.search_products(db, "notebook", cursor=cursor, limit=3)
+    assert len(first) == 3 and len(second) == 2 and end is None
+    assert not {p.id for p in first} & {p.id for p in second}
+
+def test_index_follows_updates_and_sold_items(db, make_product):
+    product = make_product("Graphing calculator", "TI-84")
+    product.name = "Scientific calculator"
+    db.commit()
+    
+    assert results(db, "graphing") == []
+    assert [p.id for p in results(db, "scientific")] == [product.id]
+    
+    models.update_product_sold_status(db, product.id, is_sold=1)
+    assert results(db, "scientific") == []
+    
+    db.delete(product)
+    db.commit()
+    assert results(db, "calculator") == []
+
+def test_rebuild_restores_index(db, db_engine, make_product):
+    make_product("Lab coat", "Size M")
+    with db_engine.begin() as conn:
+        conn.exec_driver_sql(f"INSERT INTO {search.FTS_TABLE}({search.FTS_TABLE}) VALUES ('delete-all')")
+    assert results(db, "coat") == []
+    
+    assert search.rebuild_search_index(db_engine)
+    assert [p.name for p in results(db, "coat")] == ["Lab coat"]
+
+def test_facets_count_the_whole_match_set(db, make_product, category):
+    other = models.Category(name="Electronics", description="Gadgets")
+    db.add(other)
+    db.commit()
+    make_product("Calculus book", price=50, condition="Good")
+    make_product("Calculus workbook", price=450, condition="Like New")
+    make_product("Calculator", price=1200, condition="Good", category_id=other.id)
+    make_product("Desk", price=3000)
+    
+    facets = models.search_facets(db, "calcul")
+    assert facets["total"] == 3
+    assert [(c["name"], c["count"]) for c in facets["categories"]] == [("Textbooks", 2), ("Electronics", 1)]
+    conditions = {c["value"]: c["count"] for c in facets["conditions"]}
+    assert conditions["Good"] == 2 and conditions["Like New"] == 1 and conditions["Poor"] == 0
+    assert [b["count"] for b in facets["prices"]] == [1, 1, 0, 1, 0]
+    assert facets["prices"][-1]["max"] is None
+
+def test_each_facet_ignores_its_own_filter(db, make_product, category):
+    other = models.Category(name="Electronics", description="Gadgets")
+    db.add(other)
+    db.commit()
+    make_product("Calculus book", price=50, condition="Good")
+    make_product("Calculus workbook", price=450, condition="Like New")
+    make_product("Calculator", price=1200, condition="Good", category_id=other.id)
+    
+    filters = schemas.ProductFilters(category_id=category.id, condition="Good")
+    facets = models.search_facets(db, "calcul", filters)
+    assert facets["total"] == 1
+    # Picking a category still lists the others to switch to
+    assert [(c["name"], c["count"]) for c in facets["categories"]] == [("Electronics", 1), ("Textbooks", 1)]
+    conditions = {c["value"]: c["count"] for c in facets["conditions"]}
+    assert conditions["Good"] == 1 and conditions["Like New"] == 1
+    assert [b["count"] for b in facets["prices"]] == [1, 0, 0, 0, 0]
+    
+    filters = schemas.ProductFilters(max_price=500)
+    facets = models.search_facets(db, "calcul", filters)
+    assert facets["total"] == 2
+    assert [(c["name"], c["count"]) for c in facets["categories"]] == [("Textbooks", 2)]
+    assert [b["count"] for b in facets["prices"]] == [1, 1, 0, 1, 0]
+
+def test_facets_use_one_query(db, db_engine, make_product):
+    from sqlalchemy import event
+    make_product("Lamp", price=10)
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db_engine, "before_cursor_execute", listener)
+    try:
+        models.search_facets(db, "lamp")
+    finally:
+        event.remove(db_engine, "before_cursor_execute", listener)
+    assert len(statements) == 1
+
+def test_filters_and_sorting(db, make_product):
+    make_product("Chem notes", price=80, condition="Good")
+    make_product("Physics notes", price=300, condition="Fair")
+    make_product("Maths notes", price=900, condition="Good")
+    
+    filters = schemas.ProductFilters(min_price=100, max_price=1000, sort="price_desc")
+    assert [p.name for p in results(db, "notes", filters)] == ["Maths notes", "Physics notes"]
+    
+    filters = schemas.ProductFilters(condition="Good", sort="price_asc")
+    assert [p.name for p in results(db, "notes", filters)] == ["Chem notes", "Maths notes"]
+    assert models.search_facets(db, "notes", filters)["total"] == 2
+    
+    # Filters alone browse the whole catalog
+    filters = schemas.ProductFilters(max_price=100)
+    assert [p.name for p in results(db, "", filters)] == ["Chem notes"]
+
+def test_filtered_browse_uses_composite_index(db, category):
+    filters = schemas.ProductFilters(category_id=category.id, min_price=10, max_price=50, sort="price_asc")
+    matches, _ = models._search_matches(db, "", filters)
+    keys, _ = models.SEARCH_SORTS["price_asc"]
+    sql = str(matches.order_by(*keys).statement.compile(
+        compile_kwargs={"literal_binds": True}
+    ))
+    plan = " ".join(row[-1] for row in db.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+    assert "ix_products_sold_category_price" in plan
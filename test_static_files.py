@@ -0,0 +1,78 @@
+import os
+import pytest
+import static_files
+from static_files import IMMUTABLE, REVALIDATE, asset_url, compress, fingerprint_all
+
+IMAGE = "images/products/ab/cd/" + "abcd" * 16 + ".jpg"
+
+@pytest.fixture
+def static(client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("static/images/products/ab/cd")
+    with open(f"static/{IMAGE}", "wb") as f:
+        f.write(b"\xff\xd8\xff" + b"\x00" * 100)
+    with open("static/app.css", "w") as f:
+        f.write("body { margin: 0; }\n" * 50)
+    return client
+
+def test_content_addressed_image_is_immutable(static):
+    response = static.get(f"/static/{IMAGE}")
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == IMMUTABLE
+
+def test_conditional_request_gets_304(static):
+    first = static.get("/static/app.css")
+    assert first.headers["cache-control"] == REVALIDATE
+    again = static.get("/static/app.css", headers={"If-None-Match": first.headers["etag"]})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["cache-control"] == REVALIDATE
+
+def test_fingerprinted_url_is_immutable_until_the_file_changes(static):
+    url = asset_url("app.css")
+    assert url.startswith("/static/app.css?v=")
+    assert static.get(url).headers["cache-control"] == IMMUTABLE
+
+    with open("static/app.css", "a") as f:
+        f.write("p { color: red; }\n")
+    # The old fingerprint is no longer safe to cache forever
+    assert static.get(url).headers["cache-control"] == REVALIDATE
+    assert asset_url("app.css") != url
+
+def test_precompressed_variant_is_served(static):
+    assert compress() >= 1
+    response = static.get("/static/app.css", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["content-type"].startswith("text/css")
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) == os.path.getsize("static/app.css.gz")
+    # httpx decodes the body for us
+    assert response.text == "body { margin: 0; }\n" * 50
+
+    refused = static.get("/static/app.css", headers={"Accept-Encoding": "gzip;q=0"})
+    assert "content-encoding" not in refused.headers
+    # Nothing stale is rebuilt
+    assert compress() == 0
+
+def test_compress_skips_the_product_image_store(static):
+    with open(f"static/{IMAGE}.json", "w") as f:
+        f.write("{}")
+    compress()
+    assert not os.path.exists(f"static/{IMAGE}.json.gz")
+    assert os.path.exists("static/app.css.gz")
+
+def test_serving_never_hashes_a_file(static, monkeypatch):
+    url = asset_url("app.css")
+    with open("static/app.css", "a") as f:
+        f.write("p { color: red; }\n")
+    hashed = []
+    monkeypatch.setattr(static_files, "fingerprint", lambda path: hashed.append(path))
+    # Changed since it was fingerprinted: revalidated rather than hashed on the loop
+    assert static.get(url).headers["cache-control"] == REVALIDATE
+    assert hashed == []
+
+def test_startup_fingerprints_assets_but_not_product_images(static, monkeypatch):
+    monkeypatch.setattr(static_files, "_fingerprints", {})
+    assert fingerprint_all() == 1
+    assert list(static_files._fingerprints) == [os.path.realpath("static/app.css")]
+    assert static.get(asset_url("app.css")).headers["cache-control"] == IMMUTABLE
@@ -0,0 +1,106 @@
+import asyncio
+import pytest
+import models
+import suggest
+from suggest import SuggestionIndex
+
+@pytest.fixture
+def index(db, category, monkeypatch):
+    index = SuggestionIndex()
+    monkeypatch.setattr(models, "suggestion_index", index)
+    index.build(db)
+    return index
+
+def labels(results):
+    return [r["label"] for r in results]
+
+def test_prefix_completion_covers_products_and_categories(index, make_product):
+    make_product("Graphing calculator")
+    make_product("TI-84 Calculator")
+    make_product("Textbook stand")
+    
+    assert labels(index.suggest("calc")) == ["TI-84 Calculator", "Graphing calculator"]
+    assert labels(index.suggest("text")) == ["Textbooks", "Textbook stand"]
+    assert index.suggest("text")[0]["url"].startswith("/category/")
+    assert labels(index.suggest("graph calc")) == ["Graphing calculator"]
+    assert index.suggest("  ") == []
+
+def test_typos_are_tolerated(index, make_product):
+    make_product("Scientific calculator")
+    
+    assert labels(index.suggest("calcualtor")) == ["Scientific calculator"]
+    assert labels(index.suggest("scientfic")) == ["Scientific calculator"]
+    assert index.suggest("xyz") == []
+
+def test_index_tracks_listing_changes(db, index, make_product):
+    product = make_product("Desk lamp")
+    assert labels(index.suggest("lamp")) == ["Desk lamp"]
+    
+    models.update_product_sold_status(db, product.id, is_sold=1)
+    assert index.suggest("lamp") == []
+    
+    models.update_product_sold_status(db, product.id, is_sold=0)
+    assert labels(index.suggest("lamp")) == ["Desk lamp"]
+    
+    index.product_removed(product.id)
+    assert index.suggest("lamp") == []
+
+def test_index_goes_stale(index, monkeypatch):
+    assert not index.is_stale()
+    monkeypatch.setattr(suggest, "REFRESH_SECONDS", -1)
+    assert index.is_stale()
+
+def test_typos_are_found_through_the_deletion_map(index, make_product):
+    make_product("Scientific calculator")
+    make_product("Desk lamp")
+    
+    # Inserted, dropped and swapped letters, at every query length
+    assert labels(index.suggest("calcuulator")) == ["Scientific calculator"]
+    assert labels(index.suggest("calclator")) == ["Scientific calculator"]
+    assert labels(index.suggest("dsek")) == ["Desk lamp"]
+    # Prefixes of a removed product linger in the map but find nothing
+    index.product_removed(index.suggest("lamp")[0]["id"])
+    assert index.suggest("lmap") == []
+
+def test_prefix_scan_stops_early(index, make_product):
+    for n in range(30):
+        make_product(f"Lamp {n}")
+    
+    assert len(index.suggest("lamp", limit=5)) == 5
+    assert len(index.suggest("lamp 2", limit=5)) == 5
+
+def test_lookups_examine_a_bounded_number_of_words(index, make_product, monkeypatch):
+    monkeypatch.setattr(suggest, "MAX_SCAN_WORDS", 5)
+    for n in range(20):
+        make_product(f"Chair {n}")
+    make_product("Graphing calculator")
+    
+    # The earlier word narrows the entries checked for the last one
+    assert labels(index.suggest("graph c")) == ["Graphing calculator"]
+    # An earlier word nobody has ends the lookup before any scan
+    assert index.suggest("scientfic graph") == []
+    # A scan gives up after MAX_SCAN_WORDS words, hits or not
+    assert len(index.suggest("chair", limit=20)) == 5
+
+def test_refresh_runs_one_rebuild_at_a_time(db, index, make_product, monkeypatch):
+    class Pool:
+        calls = 0
+        async def call(self, fn):
+            Pool.calls += 1
+            await asyncio.sleep(0.01)
+            return fn(db)
+    
+    make_product("Desk lamp")
+    index._built_at = None
+    
+    async def requests():
+        # Callers before the first build wait for it and share it
+        await asyncio.gather(*(index.refresh(Pool()) for _ in range(5)))
+        assert Pool.calls == 1 and labels(index.suggest("lamp")) == ["Desk lamp"]
+        # Later rebuilds run in the background while the old index serves
+        monkeypatch.setattr(suggest, "REFRESH_SECONDS", -1)
+        await asyncio.gather(*(index.refresh(Pool()) for _ in range(5)))
+        assert Pool.calls == 2 and labels(index.suggest("lamp")) == ["Desk lamp"]
+        await index._refresh
+    
+    asyncio.run(requests())
@@ -0,0 +1,164 @@
+import asyncio
+import hashlib
+import io
+import os
+import pytest
+from fastapi import HTTPException, UploadFile
+import image_store
+import models
+from conftest import login
+from uploads import receive_image_upload, sniff_image_type
+
+def sharded_name(data, extension):
+    digest = hashlib.sha256(data).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 100
+
+class CountingFile(io.BytesIO):
+    """Remembers the largest read the upload code asked for"""
+    largest_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.largest_read = max(self.largest_read, len(data))
+        return data
+
+def upload(data):
+    return UploadFile(file=CountingFile(data), filename="photo.png")
+
+def store(image, directory, **kwargs):
+    """Save an upload the way /sell does and return its name in the store"""
+    pending = asyncio.run(receive_image_upload(image, directory=str(directory), **kwargs))
+    try:
+        with image_store.storing(pending.temp_path, pending.digest, pending.extension, pending.directory) as url:
+            return url[len(image_store.URL_PREFIX):]
+    finally:
+        pending.discard()
+
+def test_sniff_image_type():
+    assert sniff_image_type(b"\xff\xd8\xff\xe0rest") == ".jpg"
+    assert sniff_image_type(PNG) == ".png"
+    assert sniff_image_type(b"GIF89a...") == ".gif"
+    assert sniff_image_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == ".webp"
+    assert sniff_image_type(b"<?php echo 1; ?>") is None
+
+def test_streams_to_its_content_address(tmp_path):
+    image = upload(PNG * 1000)
+    filename = store(image, tmp_path, chunk_size=4096)
+    assert filename == sharded_name(PNG * 1000, ".png")
+    assert (tmp_path / filename).read_bytes() == PNG * 1000
+    assert sorted(os.listdir(tmp_path)) == [".locks", filename[:2]]
+    assert image.file.largest_read <= 4096
+
+def test_identical_uploads_are_stored_once(tmp_path):
+    first = store(upload(PNG), tmp_path)
+    second = store(upload(PNG), tmp_path)
+    assert first == second
+    assert [name for name in os.listdir(tmp_path / os.path.dirname(first))] == [os.path.basename(first)]
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".upload-")]
+
+def test_oversized_upload_is_abandoned(tmp_path):
+    image = upload(PNG + b"\x00" * 10_000)
+    with pytest.raises(HTTPException) as excinfo:
+        store(image, tmp_path, max_size=5000, chunk_size=1024)
+    assert excinfo.value.status_code == 400
+    # Stopped reading after the chunk that crossed the limit, and left nothing behind
+    assert image.file.tell() <= 5000 + 1024
+    assert os.listdir(tmp_path) == []
+
+def test_non_image_is_rejected(tmp_path):
+    with pytest.raises(HTTPException):
+        store(upload(b"<?php system($_GET['c']); ?>"), tmp_path)
+    assert os.listdir(tmp_path) == []
+
+def test_sell_saves_the_streamed_image(client, db, seller, category, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("static/images/products")
+    login(client, seller)
+    response = client.post("/sell", data={
+        "name": "Desk lamp", "description": "Warm light", "price": "12", "category_id": str(category.id), "condition": "Good"
+    }, files={"image": ("lamp.jpeg", PNG, "image/jpeg")}, follow_redirects=False)
+    assert response.status_code == 303
+    
+    product = db.query(models.Product).filter(models.Product.name == "Desk lamp").one()
+    assert product.image_url == "/static/images/products/" + sharded_name(PNG, ".png")
+    assert (tmp_path / product.image_url.lstrip("/")).read_bytes() == PNG
+    stored = db.query(models.StoredImage).filter(models.StoredImage.path == product.image_url).one()
+    assert (stored.bytes, stored.product_id) == (len(PNG), product.id)
+    assert stored.sha256 == hashlib.sha256(PNG).hexdigest()
+
+def test_stored_image_is_world_readable(tmp_path):
+    filename = store(upload(PNG), tmp_path)
+    assert (tmp_path / filename).stat().st_mode & 0o777 == 0o644
+
+@pytest.fixture
+def limited_app():
+    from fastapi import FastAPI, File, UploadFile as Upload
+    from uploads import UploadSizeLimit
+    app = FastAPI()
+    app.add_middleware(UploadSizeLimit, limits={"/upload": 1000})
+    reads = []
+
+    @app.post("/upload")
+    async def receive(image: Upload = File(...)):
+        reads.append(image.filename)
+        return {"ok": True}
+
+    app.state.reads = reads
+    return app
+
+def test_declared_oversized_body_is_refused_before_reading(limited_app):
+    from fastapi.testclient import TestClient
+    client = TestClient(limited_app)
+    response = client.post("/upload", files={"image": ("big.png", PNG * 100, "image/png")})
+    assert response.status_code == 413
+    assert limited_app.state.reads == []
+    assert client.post("/upload", files={"image": ("small.png", PNG, "image/png")}).status_code == 200
+
+def test_undeclared_oversized_body_is_cut_off(limited_app):
+    import httpx
+    received = []
+
+    async def body():
+        yield b'--x\r\nContent-Disposition: form-data; name="image"; filename="big.png"\r\n\r\n'
+        for _ in range(100):
+            received.append(1)
+            yield PNG
+        yield b"\r\n--x--\r\n"
+
+    async def post():
+        transport = httpx.ASGITransport(app=limited_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            headers = {"Content-Type": "multipart/form-data; boundary=x"}
+            return await client.post("/upload", content=body(), headers=headers)
+
+    response = asyncio.run(post())
+    assert response.status_code == 413
+    # Stopped pulling the body soon after the limit, not at its end
+    assert len(received) < 20
+
+def test_sell_runs_no_queries_on_the_loop(client, db_engine, seller, category, tmp_path, monkeypatch):
+    import threading
+    from sqlalchemy import event
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("static/images/products")
+    login(client, seller)
+    fields = {
+        "name": "Desk lamp", "description": "Warm light", "price": "12", "category_id": str(category.id), "condition": "Good"
+    }
+    threads = []
+    
+    def record(*args):
+        threads.append(threading.current_thread().name)
+    
+    event.listen(db_engine, "before_cursor_execute", record)
+    try:
+        response = client.post(
+            "/sell", data=fields, files={"image": ("lamp.jpeg", PNG, "image/jpeg")}, follow_redirects=False
+        )
+    finally:
+        event.remove(db_engine, "before_cursor_execute", record)
+    assert response.status_code == 303
+    # Every statement ran on a db_pool thread, none on the event loop
+    assert threads and all(name.startswith("db") for name in threads)
@@ -0,0 +1,60 @@
+import time
+import pytest
+from conftest import login
+from user_cache import UserCache, user_cache
+
+def test_hits_skip_the_user_query(client, db, seller):
+    login(client, seller)
+    client.get("/api/messages/999")
+    misses = user_cache.misses
+    client.get("/api/messages/999")
+    client.get("/api/messages/999")
+    assert user_cache.misses == misses
+    assert user_cache.hits >= 2
+
+def test_changing_the_user_row_drops_cached_tokens(client, db, seller):
+    login(client, seller)
+    assert client.get("/api/messages/999").status_code == 200
+
+    seller.full_name = "Renamed Seller"
+    db.commit()
+    misses = user_cache.misses
+    client.get("/api/messages/999")
+    assert user_cache.misses == misses + 1
+
+    db.delete(seller)
+    db.commit()
+    response = client.get("/api/messages/999", follow_redirects=False)
+    assert response.headers["location"].startswith("/login")
+
+def test_snapshot_outlives_its_session(db, seller):
+    cache = UserCache()
+    email = seller.email
+    cached = cache.set("token", seller)
+    db.commit()
+    db.close()
+    assert cache.get("token") is cached
+    assert cached.email == email and cached is not seller
+
+def test_snapshot_has_no_relationships(seller):
+    cached = UserCache().set("token", seller)
+    # Fails loudly rather than looking like a user with no listings
+    with pytest.raises(AttributeError):
+        cached.products
+
+def test_entries_expire_with_the_token_and_ttl(seller):
+    cache = UserCache(ttl=60)
+    cache.set("expired", seller, expires_at=time.time() - 1)
+    assert cache.get("expired") is None
+
+    cache = UserCache(ttl=0)
+    cache.set("stale", seller)
+    time.sleep(0.01)
+    assert cache.get("stale") is None
+
+def test_cache_is_bounded(seller):
+    cache = UserCache(max_entries=2)
+    for token in ("a", "b", "c"):
+        cache.set(token, seller)
+    assert cache.get("a") is None
+    assert cache.get("c") is not None
@@ -0,0 +1,126 @@
+import hashlib
+import os
+import tempfile
+from typing import Dict, NamedTuple, Optional
+import aiofiles
+import aiofiles.os
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from image_store import IMAGE_ROOT
+
+MAX_IMAGE_SIZE = 5 * 1024 * 1024  # 5MB
+CHUNK_SIZE = 64 * 1024
+# Room for the text fields and multipart boundaries around the image
+FORM_OVERHEAD = 64 * 1024
+
+# Leading bytes of each accepted image format -> extension it is saved under
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+]
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Extension for the image format the first bytes belong to, or None"""
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+class PendingUpload(NamedTuple):
+    """An upload written to a temp file in the store, not yet at its content address"""
+    temp_path: str
+    digest: str
+    extension: str
+    directory: str
+
+    def discard(self):
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+async def receive_image_upload(
+    upload: UploadFile,
+    directory: str = IMAGE_ROOT,
+    max_size: int = MAX_IMAGE_SIZE,
+    chunk_size: int = CHUNK_SIZE
+) -> PendingUpload:
+    """
+    Stream an uploaded image to a temp file in directory one chunk at a time,
+    hashing it on the way. The format is decided by the file's magic bytes,
+    not its name, and the upload is abandoned as soon as it passes max_size
+    (UploadSizeLimit has already capped the request body while Starlette
+    read it; this is the per-file check). Hand the result to
+    image_store.storing, or discard() it.
+    """
+    chunk = await upload.read(chunk_size)
+    extension = sniff_image_type(chunk)
+    if extension is None:
+        raise HTTPException(status_code=400, detail="File must be a JPEG, PNG, GIF or WebP image")
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+    os.close(fd)
+    # mkstemp creates the file 0600, which a separate static server could not read
+    os.chmod(temp_path, 0o644)
+    try:
+        size = 0
+        digest = hashlib.sha256()
+        async with aiofiles.open(temp_path, "wb") as temp_file:
+            while chunk:
+                size += len(chunk)
+                if size > max_size:
+                    raise HTTPException(status_code=400, detail=f"File size too large (max {max_size // (1024 * 1024)}MB)")
+                digest.update(chunk)
+                await temp_file.write(chunk)
+                chunk = await upload.read(chunk_size)
+        return PendingUpload(temp_path, digest.hexdigest(), extension, directory)
+    except BaseException:
+        if os.path.exists(temp_path):
+            await aiofiles.os.remove(temp_path)
+        raise
+
+def _too_large(limit: int) -> str:
+    return f"Request body too large (max {limit // (1024 * 1024)}MB)"
+
+class UploadSizeLimit:
+    """
+    ASGI middleware capping the request body on upload routes. Starlette
+    parses and spools a whole multipart form before the handler runs, so
+    receive_image_upload alone would only turn away an oversized image after
+    all of it had arrived. Here a declared Content-Length over the limit is
+    refused before any of the body is read, and a body without one is
+    counted as it arrives and abandoned once it passes the limit.
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        declared = Headers(scope=scope).get("content-length", "")
+        if declared.isdigit() and int(declared) > limit:
+            response = JSONResponse({"detail": _too_large(limit)}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside form parsing, which FastAPI passes on as is
+                    raise HTTPException(status_code=413, detail=_too_large(limit))
+            return message
+
+        await self.app(scope, limited_receive, send)
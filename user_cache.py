@@ -0,0 +1,70 @@
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from datetime import datetime
+from typing import Optional
+
+@dataclass(frozen=True)
+class CachedUser:
+    """
+    The User columns a request needs, as plain data: no relationships and
+    no session, so query related rows by id.
+    """
+    id: int
+    email: str
+    full_name: Optional[str]
+    university: Optional[str]
+    domain: Optional[str]
+    google_id: Optional[str]
+    picture: Optional[str]
+    created_at: Optional[datetime]
+
+def snapshot(user) -> CachedUser:
+    """A session-free copy of a User's columns, safe to hand to any request"""
+    return CachedUser(**{field.name: getattr(user, field.name) for field in fields(CachedUser)})
+
+class UserCache:
+    """Verified access token -> CachedUser, so requests skip the JWT decode and user query"""
+
+    # Entries also expire with their token. A user changed in another worker
+    # stays cached here, as it was, for up to ttl seconds
+    def __init__(self, ttl: int = 60, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[0] < time.monotonic() or (entry[1] and entry[1] < time.time()):
+                self._entries.pop(token, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, token: str, user, expires_at: Optional[float] = None):
+        """Cache a snapshot of user for token and return it; expires_at is the token's exp claim"""
+        copy = snapshot(user)
+        with self._lock:
+            self._entries[token] = (time.monotonic() + self.ttl, expires_at, copy)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return copy
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            for token in [token for token, entry in self._entries.items() if entry[2].id == user_id]:
+                del self._entries[token]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+user_cache = UserCache()